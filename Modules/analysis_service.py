@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import urllib.request
+from collections import OrderedDict
+from http.server import HTTPServer, BaseHTTPRequestHandler
+import numpy as np
+
+import campaign as cp
+import plotting_functions as pf
+
+# Long-lived analysis service: the samples of the given campaign files are loaded and
+# matched once, all their selections are kept in memory and histogram / efficiency /
+# mean / plot requests are answered over a local HTTP API, e.g.
+#   curl -d '{"numerator": "displaced_SA", "denominator": "gen_disp", "column": "theColl._abs_dxy",
+#             "bins": {"arange": [0, 100, 5]}, "ptCuts": [7], "eta_region": "OMTF"}' localhost:8765/efficiency
+# Requests are handled one at a time (pyplot is not thread safe),
+# the answers of recent requests are cached.
+
+# List of available functions:
+# - start_service
+# - handle_request
+# - serve
+# - query
+
+CACHE_SIZE = 256
+
+_service = {'campaigns': {}, 'selections': {}, 'cache': OrderedDict()}
+
+
+# Load and match the samples of the campaigns and build all their selections
+def start_service(campaign_files, jobs=1):
+    campaigns = [cp.read_campaign(filename) for filename in campaign_files]
+    campaigns_and_selections = [(campaign, set(campaign['selections'])) for campaign in campaigns]
+
+    loads, matches = cp.selections_graph(campaigns_and_selections)
+    tables = cp.load_samples(loads, jobs)
+    matched = cp.match_samples(matches, tables, jobs)
+
+    for campaign, names in campaigns_and_selections:
+        _service['campaigns'][campaign['name']] = campaign
+        _service['selections'][campaign['name']] = cp.build_selections(campaign, names, tables, matched)
+    _service['cache'].clear()
+    print(f"Service ready: {', '.join(_service['campaigns'])}")
+
+
+# Campaign of a request (may be left out when only one campaign is loaded)
+def _campaign_name(request):
+    if 'campaign' in request:
+        return request['campaign']
+    if len(_service['campaigns']) != 1:
+        raise ValueError(f"'campaign' is required, loaded: {sorted(_service['campaigns'])}")
+    return next(iter(_service['campaigns']))
+
+
+# Selection of a request, optionally restricted to one eta region (BMTF, OMTF, EMTF)
+def _selection(request, name):
+    data = _service['selections'][_campaign_name(request)][name]
+    if request.get('eta_region'):
+        data = pf.select_eta_region(data, request['eta_region'])
+    return data
+
+
+# NaN is not valid JSON
+def _to_list(values):
+    return [None if np.isnan(value) else value for value in np.asarray(values, dtype=float).tolist()]
+
+
+def _selections(request):
+    return {name: len(data) for name, data in _service['selections'][_campaign_name(request)].items()}
+
+
+def _histogram(request):
+    data = _selection(request, request['selection'])
+    if 'ptCut' in request:
+        data = data[data['theL1Obj.pt'] >= request['ptCut']]
+    counts, edges = np.histogram(data[request['column']], bins=cp.make_bins(request['bins']), weights=pf.rw.row_weights(data))
+    return {'edges': _to_list(edges), 'counts': counts.tolist()}
+
+
+def _efficiency(request):
+    bins = cp.make_bins(request['bins'])
+    ptCuts = request.get('ptCuts', [0])
+    eff, eff_err = pf.calculate_efficiency_ptCuts(_selection(request, request['numerator']), _selection(request, request['denominator']),
+                                                  request['column'], bins, ptCuts)
+    return {'bin_centers': _to_list(0.5 * (bins[1:] + bins[:-1])), 'ptCuts': ptCuts,
+            'eff': [_to_list(row) for row in eff], 'eff_err': [[_to_list(side) for side in row] for row in eff_err]}
+
+
+def _mean(request):
+    bin_centers, mean_values, std_errors = pf.calculate_mean(_selection(request, request['selection']), request['column1'],
+                                                             request['column2'], cp.make_bins(request['bins']))
+    return {'bin_centers': _to_list(bin_centers), 'means': _to_list(mean_values), 'std_errors': _to_list(std_errors)}
+
+
+# Make a figure exactly like a campaign plot: {"function": ..., "fig_path": ..., "args": {...}}
+def _plot(request):
+    campaign_name = _campaign_name(request)
+    plot = {'name': request.get('name', request['function']), 'function': request['function'],
+            'fig_path': request['fig_path'], 'args': request['args']}
+    outputs = cp.run_plot(_service['campaigns'][campaign_name], plot, _service['selections'][campaign_name])
+    return {'outputs': outputs}
+
+
+request_handlers = {
+    'selections': _selections,
+    'histogram': _histogram,
+    'efficiency': _efficiency,
+    'mean': _mean,
+    'plot': _plot,
+}
+
+
+# Answer one request, from the cache if the same request was seen recently
+# (and, for plots, their files are still there)
+def handle_request(kind, request):
+    if kind not in request_handlers:
+        raise ValueError(f"Unknown request '{kind}', available: {sorted(request_handlers)}")
+    cache = _service['cache']
+    key = json.dumps([kind, request], sort_keys=True)
+    if key in cache and all(os.path.exists(output) for output in cache[key].get('outputs', [])):
+        cache.move_to_end(key)
+        return cache[key]
+
+    result = request_handlers[kind](request)
+    cache[key] = result
+    cache.move_to_end(key)
+    if len(cache) > CACHE_SIZE:
+        cache.popitem(last=False)
+    return result
+
+
+class AnalysisRequestHandler(BaseHTTPRequestHandler):
+    def _answer(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _handle(self, request):
+        start = time.perf_counter()
+        try:
+            result = handle_request(self.path.strip('/'), request)
+        except (KeyError, ValueError, TypeError) as error:
+            self._answer(400, {'error': f'{type(error).__name__}: {error}'})
+            return
+        self._answer(200, dict(result, time_ms=round(1000 * (time.perf_counter() - start), 3)))
+
+    def do_GET(self):
+        self._handle({})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError as error:
+            self._answer(400, {'error': f'Invalid JSON: {error}'})
+            return
+        self._handle(request)
+
+
+# Serve requests until interrupted (only on the local interface by default)
+def serve(host='127.0.0.1', port=8765):
+    server = HTTPServer((host, port), AnalysisRequestHandler)
+    print(f'Listening on http://{host}:{port}/ ({", ".join(sorted(request_handlers))})')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+# Send a request to a running service and return the answer
+def query(kind, request=None, host='127.0.0.1', port=8765):
+    data = json.dumps(request or {}).encode()
+    with urllib.request.urlopen(f'http://{host}:{port}/{kind}', data=data) as response:
+        return json.loads(response.read())
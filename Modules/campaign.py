@@ -0,0 +1,650 @@
+import os
+import sys
+import json
+import hashlib
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
+
+import system_and_data as sd
+import plotting_functions as pf
+import instrumentation as ins
+import partitioned_dataset as pds
+
+# A campaign file (YAML or TOML) describes:
+# - samples:    name -> ROOT file (loaded from data_path, tree)
+# - selections: name -> object type of one sample matched to its gen muons
+#               (or the gen table itself, or with match: false all the candidates of
+#               the type, e.g. for trigger rates), or a further cut on a parent selection
+# - reweightings: name -> ratio table of the gen spectra of a target / source selection in
+#               1 or 2 columns (see reweighting.py); a selection with reweight: <name> gets
+#               the weight of every row, which all its histograms, efficiencies and means use
+# - dataset:    optional partitioned Parquet dataset (export_dataset, partitioned_dataset.py):
+#               the gen and matched selections are read from it instead of the ROOT files,
+#               only the partitions of their eta_region, only their columns (when given) and
+#               with their range cuts pushed down to skip row groups
+# - figures:    name -> output directory
+# - plots:      list of pf.* calls with the selections they use and tags
+#
+# Every (file, branch) is loaded once and every (file, object type) is matched once,
+# also when several campaign files share the same samples.
+#
+# Builds are incremental: every figure directory keeps a manifest with, for each plot,
+# a hash of its inputs (sample files and sampling, selection, binning and arguments, plot code) and
+# the files it wrote. Only the plots whose hash changed are remade, only the samples
+# they need are loaded, and the outputs of removed (or moved) plots are deleted.
+#
+# With save_data: true the arrays behind every figure are stored next to it (.npz),
+# so the figures can be redrawn (replot_campaigns) without loading the samples; figures redrawn with
+# another profile get a suffix (e.g. _preview.png) and are kept in the manifest with the plot.
+# After each run every figure directory gets a contact_sheet.html with all its figures.
+# Efficiency plots with fit: erf (or sigmoid) also write the fitted turn-ons, collected per
+# directory in turn_on_fits.csv.
+# Optional stage_budgets: {stage: seconds} limit the total wall time of the instrumented
+# stages (see instrumentation.py), run_campaign.py fails when one is exceeded.
+
+# List of available functions:
+# - read_campaign
+# - make_bins
+# - select_plots
+# - plot_selection_names
+# - required_selections
+# - sample_fingerprint
+# - code_version
+# - plot_key
+# - read_manifest
+# - write_manifest
+# - build_graph
+# - selections_graph
+# - dataset_table
+# - load_samples
+# - match_samples
+# - build_selections
+# - export_dataset
+# - run_plot
+# - stage_budgets
+# - replot_campaigns
+# - record_replot
+# - outdated_plots
+# - plan_campaigns
+# - prune_manifests
+# - write_contact_sheet
+# - write_fit_summary
+# - run_campaigns
+
+BRANCH_L1 = 'l1ObjColl/theL1Obj/theL1Obj.*'
+BRANCH_GEN = 'genColl/theColl/theColl._*'
+TREE_NAME = "tOmtf;3"
+
+# theL1Obj.type of the objects which can be selected by name
+object_types = {'OMTF': 10, 'TK': 15, 'SA': 16}
+
+# Arguments of the pf.* functions which take selections (by name) instead of values
+data_arguments = ['data', 'datasets', 'data_numerator', 'data_denominator',
+                  'datasets_numerator', 'datasets_denominator']
+
+plot_functions = {
+    'histogram_1D_comparison': pf.histogram_1D_comparison,
+    'histogram_2D': pf.histogram_2D,
+    'plot_mean_comparison': pf.plot_mean_comparison,
+    'plot_efficiency_comparison': pf.plot_efficiency_comparison,
+    'plot_efficiency_ptCuts_single_dataset': pf.plot_efficiency_ptCuts_single_dataset,
+    'plot_3_eta_ranges': pf.plot_3_eta_ranges,
+    'plot_rate_comparison': pf.plot_rate_comparison,
+    'plot_rate_vs_efficiency': pf.plot_rate_vs_efficiency,
+}
+
+# Manifest kept in every figure directory
+MANIFEST_NAME = '.plots_manifest.json'
+CONTACT_SHEET_NAME = 'contact_sheet.html'
+FIT_SUMMARY_NAME = 'turn_on_fits.csv'
+
+# Selections handed over to the plotting worker processes (inherited through fork)
+_worker_selections = {}
+
+
+# Read a campaign file and fill in the defaults
+def read_campaign(filename):
+    if filename.endswith('.toml'):
+        import tomllib
+        with open(filename, 'rb') as f:
+            campaign = tomllib.load(f)
+    else:
+        import yaml
+        with open(filename) as f:
+            campaign = yaml.safe_load(f)
+
+    campaign['file'] = filename
+    campaign.setdefault('name', os.path.splitext(os.path.basename(filename))[0])
+    campaign.setdefault('tree', TREE_NAME)
+    campaign.setdefault('figures', {})
+    campaign.setdefault('reweightings', {})
+    campaign.setdefault('dataset', None)
+    campaign.setdefault('save_data', False)
+
+    for plot in campaign['plots']:
+        if plot['function'] not in plot_functions:
+            raise ValueError(f"{filename}: unknown plot function '{plot['function']}' in plot '{plot['name']}'")
+        plot.setdefault('tags', [])
+        plot.setdefault('args', {})
+    return campaign
+
+
+# Make numpy bins from the campaign notation: list of edges, {arange: [...]} or {linspace: [...]}
+def make_bins(spec):
+    if isinstance(spec, dict):
+        if 'arange' in spec:
+            return np.arange(*spec['arange'])
+        if 'linspace' in spec:
+            return np.linspace(*spec['linspace'])
+        raise ValueError(f'Unknown bins specification: {spec}')
+    return np.asarray(spec)
+
+
+# Choose the plots to run: all of them, or the ones with any of the tags / names given
+def select_plots(campaign, tags=None, names=None):
+    plots = campaign['plots']
+    if tags:
+        plots = [plot for plot in plots if set(tags) & set(plot['tags'])]
+    if names:
+        plots = [plot for plot in plots if plot['name'] in names]
+    return plots
+
+
+# Names of the selections passed directly to one plot
+def plot_selection_names(plot):
+    names = []
+    for argument in data_arguments:
+        value = plot['args'].get(argument)
+        if value is None:
+            continue
+        names += [value] if isinstance(value, str) else value
+    return names
+
+
+# Names of all the selections (including parents) used by the plots
+def required_selections(campaign, plots):
+    required = set()
+
+    def add(name):
+        if name in required:
+            return
+        if name not in campaign['selections']:
+            raise ValueError(f"{campaign['file']}: unknown selection '{name}'")
+        required.add(name)
+        parent = campaign['selections'][name].get('parent')
+        if parent:
+            add(parent)
+        reweight = campaign['selections'][name].get('reweight')
+        if reweight:
+            add(_reweighting(campaign, reweight)['source'])
+            add(_reweighting(campaign, reweight)['target'])
+
+    for plot in plots:
+        for name in plot_selection_names(plot):
+            add(name)
+    return required
+
+
+def _reweighting(campaign, name):
+    if name not in campaign['reweightings']:
+        raise ValueError(f"{campaign['file']}: unknown reweighting '{name}'")
+    return campaign['reweightings'][name]
+
+
+# Output directory of a plot
+def _fig_path(campaign, plot):
+    return campaign['figures'].get(plot['fig_path'], plot['fig_path'])
+
+
+# Cheap fingerprint of an input file: path, size and modification time
+def sample_fingerprint(campaign, sample):
+    filename = os.path.join(campaign['data_path'], campaign['samples'][sample]['file'])
+    try:
+        stat = os.stat(filename)
+        return [filename, campaign['tree'], stat.st_size, stat.st_mtime_ns]
+    except FileNotFoundError:
+        return [filename, campaign['tree'], None, None]
+
+
+# Hash of the code which turns the samples into figures
+def code_version():
+    version = hashlib.sha256()
+    for module in (sd, pf, pf.unc, pf.turn_on, pf.rates, pf.rw, pds, sys.modules[__name__]):
+        with open(module.__file__, 'rb') as f:
+            version.update(f.read())
+    return version.hexdigest()
+
+
+# Full description of a selection: its cuts, its parents and the sample it comes from
+def _selection_inputs(campaign, name):
+    spec = dict(campaign['selections'][name])
+    if 'parent' in spec:
+        spec['parent'] = _selection_inputs(campaign, spec['parent'])
+    elif dataset_table(campaign, spec):
+        table = pds.tables(campaign['dataset'])[dataset_table(campaign, spec)]
+        spec['sample'] = [campaign['dataset'], table['source'], table['written']]
+    else:
+        spec['sample'] = sample_fingerprint(campaign, spec['sample'])
+    if 'reweight' in spec:
+        reweighting = dict(_reweighting(campaign, spec['reweight']))
+        reweighting['bins'] = [make_bins(bins).tolist() for bins in reweighting['bins']]
+        reweighting['source'] = _selection_inputs(campaign, reweighting['source'])
+        reweighting['target'] = _selection_inputs(campaign, reweighting['target'])
+        spec['reweight'] = reweighting
+    return spec
+
+
+# Hash of everything that goes into one plot
+def plot_key(campaign, plot, version):
+    args = dict(plot['args'])
+    args['bins'] = make_bins(args['bins']).tolist()
+    if 'n_events' in args:
+        samples = [args['n_events']] if np.ndim(args['n_events']) == 0 else args['n_events']
+        args['n_events'] = [sample_fingerprint(campaign, sample) if isinstance(sample, str) else sample for sample in samples]
+    inputs = {
+        'function': plot['function'],
+        'args': args,
+        'fig_path': _fig_path(campaign, plot),
+        'save_data': campaign['save_data'],
+        'render_profile': pf.render_profile,
+        'uncertainty': pf.uncertainty,
+        'sampling': {key: sd.reading[key] for key in ('fraction', 'sampling')},
+        'selections': {name: _selection_inputs(campaign, name) for name in plot_selection_names(plot)},
+        'code': version,
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+
+# Manifest of a figure directory: {campaign/plot: {'key': ..., 'outputs': [...]}}
+def read_manifest(fig_path):
+    try:
+        with open(os.path.join(fig_path, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def write_manifest(fig_path, manifest):
+    os.makedirs(fig_path, exist_ok=True)
+    filename = os.path.join(fig_path, MANIFEST_NAME)
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(filename + '.tmp', filename)
+
+
+# Remove the files of a manifest entry which no other entry still uses
+def _remove_outputs(manifest, outputs, keep=()):
+    used = set(keep)
+    for entry in manifest.values():
+        used.update(entry['outputs'])
+    for output in outputs:
+        if output not in used and os.path.exists(output):
+            os.remove(output)
+            print(f'Removed stale figure: {output}')
+
+
+# Key of a loaded (file, branch) table, shared between campaigns
+def _load_key(campaign, sample, branch):
+    return (campaign['data_path'], campaign['samples'][sample]['file'], campaign['tree'], branch)
+
+
+# Table of the campaign dataset ('<sample file>/<object>') a selection is read from, None when it
+# is read from the ROOT files (no dataset, a selection with match: false, or a table not exported).
+# The dataset holds whole tables, so it cannot be combined with sampling (sd.reading['fraction'] < 1)
+def dataset_table(campaign, selection):
+    if not campaign['dataset'] or 'sample' not in selection or not selection.get('match', True):
+        return None
+    name = f"{_dataset_sample(campaign, selection['sample'])}/{selection.get('object', 'gen')}"
+    if name not in pds.tables(campaign['dataset']):
+        return None
+    if sd.reading['fraction'] < 1:
+        raise ValueError(f"{campaign['file']}: sampling (fraction {sd.reading['fraction']}) cannot be used with the dataset "
+                         f"{campaign['dataset']}, which holds the full tables; remove 'dataset' from the campaign to sample the ROOT files")
+    return name
+
+
+# Sample name in the dataset: the ROOT file name without extension (the same in every campaign)
+def _dataset_sample(campaign, sample):
+    return os.path.splitext(os.path.basename(campaign['samples'][sample]['file']))[0]
+
+
+# Dependency graph: which (file, branch) tables and which matchings are needed
+def build_graph(campaigns_and_plots):
+    return selections_graph([(campaign, required_selections(campaign, plots)) for campaign, plots in campaigns_and_plots])
+
+
+# Same graph for the given selections of each campaign
+def selections_graph(campaigns_and_selections):
+    loads = set()
+    matches = set()
+    for campaign, names in campaigns_and_selections:
+        for name in names:
+            selection = campaign['selections'][name]
+            if 'sample' not in selection or dataset_table(campaign, selection):
+                continue
+            gen_key = _load_key(campaign, selection['sample'], BRANCH_GEN)
+            if not selection.get('match', True):
+                loads.add(_load_key(campaign, selection['sample'], BRANCH_L1))
+                continue
+            loads.add(gen_key)
+            if selection.get('object', 'gen') != 'gen':
+                l1_key = _load_key(campaign, selection['sample'], BRANCH_L1)
+                loads.add(l1_key)
+                matches.add((l1_key, gen_key, object_types[selection['object']]))
+    return loads, matches
+
+
+# Load every (file, branch) once, in parallel
+def load_samples(loads, jobs=1):
+    def load(key):
+        path, filename, tree, branch = key
+        with ins.sample_label(f"{filename}:{branch.split('/')[0]}"):
+            return key, sd.load_data(filename, path, tree, branch)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return dict(executor.map(load, sorted(loads)))
+
+
+# Select one object type and match it to the gen muons, every combination once
+def match_samples(matches, tables, jobs=1):
+    def match(key):
+        l1_key, gen_key, object_type = key
+        data = tables[l1_key]
+        with ins.sample_label(f"{l1_key[1]}:type {object_type}"):
+            return key, sd.match_gen_muons(data[data['theL1Obj.type'] == object_type], tables[gen_key])
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return dict(executor.map(match, sorted(matches)))
+
+
+# Build the selections of one campaign from the loaded and matched tables
+def build_selections(campaign, names, tables, matched):
+    selections = {}
+    ratio_tables = {}
+
+    # Every reweighting table is made once, from the source and target selections
+    def ratio_table(name):
+        if name not in ratio_tables:
+            reweighting = _reweighting(campaign, name)
+            ratio_tables[name] = pf.rw.ratio_table(build(reweighting['source']), build(reweighting['target']), reweighting['columns'],
+                                                   [make_bins(bins) for bins in reweighting['bins']])
+        return ratio_tables[name]
+
+    def build(name):
+        if name in selections:
+            return selections[name]
+        spec = campaign['selections'][name]
+        # eta region, columns and range cuts already applied when reading the dataset
+        read_cuts = []
+        table = dataset_table(campaign, spec) if 'parent' not in spec else None
+        if 'parent' in spec:
+            data = build(spec['parent'])
+        else:
+            gen_key = _load_key(campaign, spec['sample'], BRANCH_GEN)
+            if table:
+                # only the partitions, columns and row groups the selection needs (cuts on derived columns come later)
+                stored = pds.tables(campaign['dataset'])[table]['columns']
+                read_cuts = [cut for cut in spec.get('range', []) if cut['column'] in stored]
+                filters = [(cut['column'], op, cut[key]) for cut in read_cuts for key, op in (('min', '>'), ('max', '<=')) if key in cut]
+                data = pds.read_partitions(campaign['dataset'], _dataset_sample(campaign, spec['sample']), spec.get('object', 'gen'),
+                                           regions=[spec['eta_region']] if 'eta_region' in spec else None,
+                                           columns=spec.get('columns'), filters=filters)
+            elif spec.get('object', 'gen') == 'gen':
+                data = tables[gen_key]
+            elif not spec.get('match', True):
+                data = tables[_load_key(campaign, spec['sample'], BRANCH_L1)]
+                data = data[data['theL1Obj.type'] == object_types[spec['object']]]
+            else:
+                l1_key = _load_key(campaign, spec['sample'], BRANCH_L1)
+                data = matched[(l1_key, gen_key, object_types[spec['object']])]
+
+        if spec.get('eta_region') and not table:
+            data = pf.select_eta_region(data, spec['eta_region'])
+        if spec.get('columns') and not table:
+            data = data[spec['columns']]
+        if spec.get('derived'):
+            data = data.copy()
+            for derived in spec['derived']:
+                numerator, denominator = derived['ratio']
+                data[derived['name']] = data[numerator] / data[denominator]
+        for cut in spec.get('range', []):
+            if cut in read_cuts:
+                continue
+            if 'min' in cut:
+                data = data[data[cut['column']] > cut['min']]
+            if 'max' in cut:
+                data = data[data[cut['column']] <= cut['max']]
+        if spec.get('veto', False):
+            data = sd.apply_veto(data)
+        if spec.get('reweight'):
+            data = pf.rw.add_weights(data, ratio_table(spec['reweight']), _reweighting(campaign, spec['reweight']).get('outside', 1.0))
+
+        selections[name] = data
+        return data
+
+    for name in sorted(names):
+        build(name)
+    return selections
+
+
+# Write the gen and matched tables of all the samples of the campaigns to a partitioned dataset
+# (read from the ROOT files, also when the campaigns already use a dataset)
+def export_dataset(campaigns, root, jobs=1):
+    if sd.reading['fraction'] < 1:
+        raise ValueError(f"The dataset holds the full tables, it cannot be exported with sampling (fraction {sd.reading['fraction']})")
+    campaigns = [dict(campaign, dataset=None) for campaign in campaigns]
+    campaigns_and_selections = [(campaign, set(campaign['selections'])) for campaign in campaigns]
+    loads, matches = selections_graph(campaigns_and_selections)
+    tables = load_samples(loads, jobs)
+    matched = match_samples(matches, tables, jobs)
+
+    object_names = {object_type: name for name, object_type in object_types.items()}
+    exports = [(key, 'gen', tables[key]) for key in sorted(loads) if key[3] == BRANCH_GEN]
+    exports += [(gen_key, object_names[object_type], matched[(l1_key, gen_key, object_type)])
+                for l1_key, gen_key, object_type in sorted(matches)]
+    os.makedirs(root, exist_ok=True)
+    for (path, filename, tree, _), object_name, data in exports:
+        stat = os.stat(os.path.join(path, filename))
+        pds.write_table(root, os.path.splitext(os.path.basename(filename))[0], object_name, data,
+                        source=[os.path.join(path, filename), tree, stat.st_size, stat.st_mtime_ns, sd.reading['fraction'], sd.reading['sampling']])
+    return [f"{os.path.splitext(os.path.basename(key[1]))[0]}/{object_name}" for key, object_name, _ in exports]
+
+
+# Event counts of a plot: numbers, or sample names whose trees are counted
+def _n_events(campaign, n_events):
+    def count(value):
+        if isinstance(value, str):
+            return sd.count_events(campaign['samples'][value]['file'], campaign['data_path'], campaign['tree'])
+        return value
+    return count(n_events) if np.ndim(n_events) == 0 else [count(value) for value in n_events]
+
+
+# Run one plot, the selections are looked up by name
+def run_plot(campaign, plot, selections=None):
+    if selections is None:
+        selections = _worker_selections[campaign['file']]
+
+    kwargs = dict(plot['args'])
+    for argument in data_arguments:
+        if argument in kwargs:
+            value = kwargs[argument]
+            kwargs[argument] = selections[value] if isinstance(value, str) else [selections[name] for name in value]
+    kwargs['bins'] = make_bins(kwargs['bins'])
+    if 'n_events' in kwargs:
+        kwargs['n_events'] = _n_events(campaign, kwargs['n_events'])
+    kwargs['fig_path'] = _fig_path(campaign, plot)
+    kwargs.setdefault('save', True)
+    kwargs.setdefault('save_data', campaign['save_data'])
+
+    with ins.sample_label(f"{campaign['name']}/{plot['name']}"):
+        fig_name = plot_functions[plot['function']](**kwargs)
+    pf.close_figures()
+    if not fig_name:
+        return []
+    outputs = [fig_name]
+    if kwargs['save_data']:
+        outputs.append(os.path.splitext(fig_name)[0] + '.npz')
+    if kwargs.get('fit'):
+        outputs.append(os.path.splitext(fig_name)[0] + '_fits.csv')
+    return outputs
+
+
+# run_plot in a forked worker, the stage records made there are sent back with the outputs
+def _run_plot_worker(campaign, plot):
+    start = len(ins.records)
+    outputs = run_plot(campaign, plot)
+    return outputs, ins.records[start:]
+
+
+# Stage budgets of the campaigns {stage: seconds}, the tightest one wins
+def stage_budgets(campaigns):
+    budgets = {}
+    for campaign in campaigns:
+        for name, budget in campaign.get('stage_budgets', {}).items():
+            budgets[name] = min(budget, budgets.get(name, budget))
+    return budgets
+
+
+# Redraw the chosen plots from the data stored with them (no ROOT files are read)
+def replot_campaigns(campaigns, tags=None, names=None, **overrides):
+    done = []
+    for campaign in campaigns:
+        for plot in select_plots(campaign, tags, names):
+            entry = read_manifest(_fig_path(campaign, plot)).get(f"{campaign['name']}/{plot['name']}")
+            data_names = [output for output in entry['outputs'] if output.endswith('.npz')] if entry else []
+            if not data_names:
+                print(f"{campaign['name']}/{plot['name']}: no stored data, run the campaign with save_data first")
+            for data_name in data_names:
+                if os.path.exists(data_name):
+                    done.append(pf.replot_from_data(data_name, **overrides))
+                    record_replot(data_name, done[-1])
+    print(f'Plots redrawn: {len(done)}')
+    return done
+
+
+# Add a redrawn figure to the manifest entry of the plot whose data it was drawn from, so that it is
+# on the contact sheet and removed with the plot (False when no entry of the directory has the data)
+def record_replot(data_name, fig_name):
+    fig_path = os.path.dirname(data_name)
+    manifest = read_manifest(fig_path)
+    for entry in manifest.values():
+        stored = [output for output in entry['outputs'] if os.path.abspath(output) == os.path.abspath(data_name)]
+        if stored:
+            fig_name = os.path.join(os.path.dirname(stored[0]), os.path.basename(fig_name))
+            if fig_name not in entry['outputs']:
+                entry['outputs'].append(fig_name)
+                write_manifest(fig_path, manifest)
+                write_contact_sheet(fig_path, manifest)
+            return True
+    return False
+
+
+# Plots of a campaign whose inputs changed since the last build
+def outdated_plots(campaign, plots, version, manifests, rebuild=False):
+    outdated = []
+    for plot in plots:
+        entry = manifests[_fig_path(campaign, plot)].get(f"{campaign['name']}/{plot['name']}")
+        if (rebuild or entry is None or entry['key'] != plot_key(campaign, plot, version)
+                or not all(os.path.exists(output) for output in entry['outputs'])):
+            outdated.append(plot)
+    return outdated
+
+
+# Forget the plots which are no longer in the campaign, or no longer in that figure directory
+# (moved to another fig_path), and delete their figures
+def prune_manifests(campaign, manifests):
+    current = {f"{campaign['name']}/{plot['name']}": os.path.normpath(_fig_path(campaign, plot)) for plot in campaign['plots']}
+    for fig_path, manifest in manifests.items():
+        for plot_id in list(manifest):
+            if plot_id.split('/', 1)[0] == campaign['name'] and current.get(plot_id) != os.path.normpath(fig_path):
+                entry = manifest.pop(plot_id)
+                _remove_outputs(manifest, entry['outputs'])
+
+
+# Thumbnails of all the figures of a directory in one HTML page
+def write_contact_sheet(fig_path, manifest):
+    fig_names = [output for plot_id in sorted(manifest) for output in manifest[plot_id]['outputs']
+                 if not output.endswith(('.npz', '.csv'))]
+    return pf.write_contact_sheet(fig_names, os.path.join(fig_path, CONTACT_SHEET_NAME), title=fig_path)
+
+
+# Turn-on fits of all the plots of a directory in one table (nothing is written when no plot has fits)
+def write_fit_summary(fig_path, manifest):
+    fit_tables = [output for plot_id in sorted(manifest) for output in manifest[plot_id]['outputs'] if output.endswith('_fits.csv')]
+    summary_name = os.path.join(fig_path, FIT_SUMMARY_NAME)
+    if not fit_tables:
+        if os.path.exists(summary_name):
+            os.remove(summary_name)
+        return None
+    return pf.turn_on.write_fit_table(summary_name, pf.turn_on.read_fit_tables(fit_tables))
+
+
+# Which plots of the campaigns have to be (re)made, nothing is loaded or written
+def plan_campaigns(campaigns, tags=None, names=None, rebuild=False):
+    version = code_version()
+    manifests = {}
+    campaigns_and_plots = []
+    for campaign in campaigns:
+        fig_paths = set(campaign['figures'].values()) | set(_fig_path(campaign, plot) for plot in campaign['plots'])
+        for fig_path in fig_paths:
+            if fig_path not in manifests:
+                manifests[fig_path] = read_manifest(fig_path)
+
+        plots = select_plots(campaign, tags, names)
+        outdated = outdated_plots(campaign, plots, version, manifests, rebuild)
+        print(f"{campaign['name']}: {len(plots) - len(outdated)} plots up to date, {len(outdated)} to make")
+        if outdated:
+            campaigns_and_plots.append((campaign, outdated))
+    return campaigns_and_plots, manifests, version
+
+
+# Run the chosen plots of all the campaigns, loading the shared data once
+# and remaking only the plots whose inputs changed (all of them with rebuild=True)
+def run_campaigns(campaigns, tags=None, names=None, jobs=1, rebuild=False):
+    campaigns_and_plots, manifests, version = plan_campaigns(campaigns, tags, names, rebuild)
+    for campaign in campaigns:
+        prune_manifests(campaign, manifests)
+
+    loads, matches = build_graph(campaigns_and_plots)
+    print(f'Campaign: {sum(len(plots) for _, plots in campaigns_and_plots)} plots, '
+          f'{len(loads)} tables to load, {len(matches)} matchings')
+    tables = load_samples(loads, jobs)
+    matched = match_samples(matches, tables, jobs)
+
+    tasks = []
+    for campaign, plots in campaigns_and_plots:
+        names_needed = required_selections(campaign, plots)
+        _worker_selections[campaign['file']] = build_selections(campaign, names_needed, tables, matched)
+        for fig_path in set(_fig_path(campaign, plot) for plot in plots):
+            os.makedirs(fig_path, exist_ok=True)
+        tasks += [(campaign, plot) for plot in plots]
+
+    # Figures are independent, render them in forked workers which share the selections
+    if jobs > 1 and len(tasks) > 1 and 'fork' in mp.get_all_start_methods():
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=mp.get_context('fork')) as executor:
+            futures = [executor.submit(_run_plot_worker, campaign, plot) for campaign, plot in tasks]
+            outputs = []
+            for future in futures:
+                plot_outputs, records = future.result()
+                outputs.append(plot_outputs)
+                ins.records.extend(records)
+    else:
+        outputs = [run_plot(campaign, plot) for campaign, plot in tasks]
+
+    # Record the new figures, drop the old ones which were renamed
+    for (campaign, plot), plot_outputs in zip(tasks, outputs):
+        manifest = manifests[_fig_path(campaign, plot)]
+        plot_id = f"{campaign['name']}/{plot['name']}"
+        old_entry = manifest.pop(plot_id, None)
+        if old_entry:
+            _remove_outputs(manifest, old_entry['outputs'], keep=plot_outputs)
+        manifest[plot_id] = {'key': plot_key(campaign, plot, version), 'outputs': plot_outputs}
+    for fig_path, manifest in manifests.items():
+        if manifest or os.path.exists(os.path.join(fig_path, MANIFEST_NAME)):
+            write_manifest(fig_path, manifest)
+            write_contact_sheet(fig_path, manifest)
+            write_fit_summary(fig_path, manifest)
+
+    print(f'Plots done: {len(tasks)}')
+    return [plot['name'] for _, plot in tasks]
@@ -0,0 +1,105 @@
+import os
+import csv
+import json
+import time
+import resource
+import contextvars
+from contextlib import contextmanager
+
+# Per-stage instrumentation of the pipeline. The stages are
+#   read -> flatten -> convert -> derive (load_data), match (match_gen_muons),
+#   fill (histograms / efficiencies / means) and render (drawing and saving a figure).
+# Every stage run is recorded with wall time, CPU time of its thread (stages of parallel loaders
+# and the prefetch thread are not counted twice), the process peak RSS at its end,
+# rows in/out and bytes read, for one sample. The records can be written as a JSON or CSV
+# run report, summarized per stage and checked against stage budgets (total wall time).
+
+# List of available functions:
+# - stage
+# - sample_label
+# - summary
+# - print_summary
+# - write_report
+# - check_budgets
+
+stages = ['read', 'flatten', 'convert', 'derive', 'match', 'fill', 'render']
+
+records = []
+
+_current_sample = contextvars.ContextVar('sample', default=None)
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# Record one run of a stage; the caller may fill in record['rows_out'] and record['bytes_read']
+@contextmanager
+def stage(name, sample=None, rows_in=None):
+    record = {'stage': name, 'sample': sample or _current_sample.get(), 'rows_in': rows_in, 'rows_out': None,
+              'bytes_read': None, 'pid': os.getpid()}
+    wall_start, cpu_start = time.perf_counter(), time.thread_time()
+    try:
+        yield record
+    finally:
+        record['wall_s'] = time.perf_counter() - wall_start
+        record['cpu_s'] = time.thread_time() - cpu_start
+        record['peak_rss_mb'] = _peak_rss_mb()
+        records.append(record)
+
+
+# Default sample name for the stages run inside (per thread)
+@contextmanager
+def sample_label(label):
+    token = _current_sample.set(label)
+    try:
+        yield
+    finally:
+        _current_sample.reset(token)
+
+
+# Totals per stage: runs, wall and CPU time, max peak RSS, rows and bytes
+def summary(run_records=None):
+    run_records = records if run_records is None else run_records
+    totals = {}
+    for record in run_records:
+        total = totals.setdefault(record['stage'], {'runs': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'peak_rss_mb': 0.0,
+                                                     'rows_in': 0, 'rows_out': 0, 'bytes_read': 0})
+        total['runs'] += 1
+        total['wall_s'] += record['wall_s']
+        total['cpu_s'] += record['cpu_s']
+        total['peak_rss_mb'] = max(total['peak_rss_mb'], record['peak_rss_mb'])
+        for key in ('rows_in', 'rows_out', 'bytes_read'):
+            total[key] += record[key] or 0
+    order = {name: i for i, name in enumerate(stages)}
+    return dict(sorted(totals.items(), key=lambda item: order.get(item[0], len(stages))))
+
+
+def print_summary(run_records=None):
+    print(f"{'stage':<10} {'runs':>6} {'wall [s]':>10} {'cpu [s]':>10} {'peak RSS [MB]':>14} {'rows in':>12} {'rows out':>12} {'MB read':>10}")
+    for name, total in summary(run_records).items():
+        print(f"{name:<10} {total['runs']:>6} {total['wall_s']:>10.3f} {total['cpu_s']:>10.3f} {total['peak_rss_mb']:>14.1f} "
+              f"{total['rows_in']:>12} {total['rows_out']:>12} {total['bytes_read'] / 2**20:>10.1f}")
+
+
+# Run report with all the records (.json also includes the summary, anything else is CSV)
+def write_report(filename, run_records=None):
+    run_records = records if run_records is None else run_records
+    if filename.endswith('.json'):
+        with open(filename, 'w') as f:
+            json.dump({'records': run_records, 'summary': summary(run_records)}, f, indent=1)
+    else:
+        columns = ['stage', 'sample', 'wall_s', 'cpu_s', 'peak_rss_mb', 'rows_in', 'rows_out', 'bytes_read', 'pid']
+        with open(filename, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(run_records)
+    return filename
+
+
+# Stages whose total wall time exceeds their budget {stage: seconds}
+def check_budgets(budgets, run_records=None):
+    totals = summary(run_records)
+    return [(name, totals[name]['wall_s'], budget) for name, budget in budgets.items()
+            if name in totals and totals[name]['wall_s'] > budget]
@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import copy
+import shutil
+import numpy as np
+
+import plotting_functions as pf
+
+# Partitioned columnar (Parquet) dataset of the gen and matched tables, so that a selection of one
+# sample, object type and eta region reads only its own files:
+#   <root>/sample=<file name>/object=<gen|SA|TK|OMTF>/region=<BMTF|OMTF|EMTF|outside>/part-0.parquet
+# The region is the one of the gen muon (pf.select_eta_region, 'outside' beyond |eta| 2.4).
+# The rows of every partition are sorted by gen pT and written in row groups of ROW_GROUP_SIZE,
+# so the Parquet min/max statistics of the row groups let pT cuts skip most of them.
+# <root>/_partitions.json keeps, per partition, its rows and the min/max of every numeric column:
+# reading prunes the partitions with it before any file is opened, then reads only the requested
+# columns and hands the filters to Parquet, which skips the row groups outside them.
+# pyarrow and pandas are imported inside the functions which need them.
+
+# List of available functions:
+# - read_manifest
+# - partition_regions
+# - write_table
+# - tables
+# - read_partitions
+
+MANIFEST_NAME = '_partitions.json'
+ROW_GROUP_SIZE = 65_536
+regions = pf.eta_regions + ['outside']
+_region_names = regions  # read_partitions has an argument called regions
+
+# Manifests already read {root: (modification time, manifest)}
+_manifests = {}
+
+# Comparisons of the filters (column, op, value), also used to prune the partitions by their min/max
+_may_contain = {
+    '==': lambda low, high, value: low <= value <= high,
+    '>': lambda low, high, value: high > value,
+    '>=': lambda low, high, value: high >= value,
+    '<': lambda low, high, value: low < value,
+    '<=': lambda low, high, value: low <= value,
+}
+
+
+# Manifest of a dataset: {'tables': {'<sample>/<object>': {...}}, 'partitions': [...]},
+# read again only when the file changed (campaigns look it up for every selection)
+def read_manifest(root):
+    filename = os.path.join(root, MANIFEST_NAME)
+    try:
+        modified = os.stat(filename).st_mtime_ns
+    except FileNotFoundError:
+        return {'tables': {}, 'partitions': []}
+    if root not in _manifests or _manifests[root][0] != modified:
+        with open(filename) as f:
+            _manifests[root] = (modified, json.load(f))
+    return _manifests[root][1]
+
+
+def _write_manifest(root, manifest):
+    filename = os.path.join(root, MANIFEST_NAME)
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(filename + '.tmp', filename)
+
+
+# Rows of data in every eta region of its gen muons
+def partition_regions(data):
+    parts = {region: pf.select_eta_region(data, region) for region in pf.eta_regions}
+    inside = np.zeros(len(data), dtype=bool)
+    for part in parts.values():
+        inside |= data.index.isin(part.index)
+    parts['outside'] = data[~inside]
+    return parts
+
+
+def _statistics(data):
+    statistics = {}
+    for column in data.columns:
+        values = data[column].to_numpy()
+        if values.dtype.kind in 'biuf' and len(values) and not np.all(np.isnan(values.astype(float))):
+            statistics[column] = [float(np.nanmin(values)), float(np.nanmax(values))]
+    return statistics
+
+
+# Write one table (the gen or matched table of a sample file and object type) as partitions,
+# replacing the earlier partitions of the same table; source identifies the input (e.g. file size, mtime)
+def write_table(root, sample, object_name, data, source=None, row_group_size=ROW_GROUP_SIZE):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    manifest = copy.deepcopy(read_manifest(root))
+    table_dir = os.path.join(root, f'sample={sample}', f'object={object_name}')
+    shutil.rmtree(table_dir, ignore_errors=True)
+    partitions = [partition for partition in manifest['partitions'] if (partition['sample'], partition['object']) != (sample, object_name)]
+
+    data = data.reset_index(drop=True)
+    for region, part in partition_regions(data).items():
+        if len(part) == 0:
+            continue
+        part = part.sort_values('theColl._pt', kind='stable').reset_index(drop=True)
+        path = os.path.join(f'sample={sample}', f'object={object_name}', f'region={region}', 'part-0.parquet')
+        os.makedirs(os.path.join(root, os.path.dirname(path)), exist_ok=True)
+        pq.write_table(pa.Table.from_pandas(part, preserve_index=False), os.path.join(root, path), row_group_size=row_group_size)
+        partitions.append({'sample': sample, 'object': object_name, 'region': region, 'path': path,
+                           'rows': len(part), 'statistics': _statistics(part)})
+
+    manifest['partitions'] = sorted(partitions, key=lambda partition: partition['path'])
+    manifest['tables'][f'{sample}/{object_name}'] = {'source': source, 'written': time.time(), 'rows': len(data),
+                                                    'columns': list(data.columns)}
+    _write_manifest(root, manifest)
+    print(f'Dataset written: {root} {sample}/{object_name}, {len(data)} rows')
+
+
+# Tables of the dataset {'<sample>/<object>': description}
+def tables(root):
+    return read_manifest(root)['tables']
+
+
+def _may_pass(partition, filters):
+    for column, op, value in filters:
+        if column in partition['statistics'] and op in _may_contain:
+            low, high = partition['statistics'][column]
+            if not _may_contain[op](low, high, value):
+                return False
+    return True
+
+
+# Read a table, only the partitions of the given regions (all when None) whose min/max can pass
+# the filters [(column, op, value), ...], only the given columns (all when None); the filters
+# are also applied to the rows (Parquet skips the row groups which cannot pass them)
+def read_partitions(root, sample, object_name, regions=None, columns=None, filters=None):
+    import pandas as pd
+    import pyarrow.parquet as pq
+
+    manifest = read_manifest(root)
+    table = manifest['tables'].get(f'{sample}/{object_name}')
+    if table is None:
+        raise ValueError(f"{root}: no table '{sample}/{object_name}', available: {sorted(manifest['tables'])}")
+    unknown = sorted(set(regions or []) - set(_region_names))
+    if unknown:
+        raise ValueError(f"Unknown eta regions {unknown}, available: {_region_names}")
+    filters = [tuple(condition) for condition in filters or []]
+    partitions = [partition for partition in manifest['partitions']
+                  if (partition['sample'], partition['object']) == (sample, object_name)
+                  and (regions is None or partition['region'] in regions) and _may_pass(partition, filters)]
+
+    parts = [pq.read_table(os.path.join(root, partition['path']), columns=columns, filters=filters or None).to_pandas()
+             for partition in partitions]
+    if not parts:
+        return pd.DataFrame(columns=columns or table['columns'])
+    return pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
@@ -1,18 +1,20 @@
 import numpy as np
-import matplotlib.pyplot as plt
-import pandas as pd
-import uproot as upr
-import awkward as ak
-from matplotlib.colors import LogNorm
-import shutil
 import os
-import mplhep as hep
-import matplotlib.pyplot as plt
-import numba as nb
 import re
-from numba import jit
+import json
+import html
+import instrumentation as ins
+import uncertainties as unc
+import turn_on
+import rates
+import reweighting as rw
+
+# matplotlib and mplhep are imported (and the CMS style applied) only when the first
+# figure is drawn, see setup_style
+plt = None
+hep = None
+LogNorm = None
 
-hep.style.use("CMS")
 params = {'legend.fontsize': 'x-large',
           'figure.figsize': (10, 7),
           'axes.labelsize': 'x-large',
@@ -20,20 +22,111 @@ params = {'legend.fontsize': 'x-large',
           'xtick.labelsize':'x-large',
           'ytick.labelsize':'x-large',
           'patch.linewidth': 2}
-plt.rcParams.update(params)
+
+# Render profiles: 'publication' is the full output, 'preview' draws fast low-resolution
+# figures while iterating (format can be switched to 'svg' or 'pdf' for vector output)
+render_profiles = {
+    'publication': {'dpi': None, 'format': 'png', 'tight_layout': True, 'cms_label': True},
+    'preview': {'dpi': 20, 'format': 'png', 'tight_layout': False, 'cms_label': False},
+}
+render_profile = dict(render_profiles['publication'], name='publication')
+
+# Error bars: efficiencies get an exact interval (clopper_pearson, wilson), a Poisson bootstrap
+# interval (bootstrap) or the normal approximation (normal); means get the standard error (sem)
+# or a Poisson bootstrap of their entries (bootstrap)
+uncertainty = {'efficiency': 'clopper_pearson', 'mean': 'sem', 'confidence': 0.683, 'n_replicas': 200, 'seed': 1}
 
 colors = ['red', 'blue', 'green', 'darkorange', 'purple', 'brown', 'pink', 'gray', 'olive', 'cyan']
 
+# The plotting functions return the path of the saved figure (None when not saved).
+# Each plot is computed first and drawn by its draw_* function from plain arrays; with
+# save_data=True the arrays are also stored next to the figure (.npz) and the figure
+# can be redrawn later by replot_from_data without reading the ROOT files again.
+# Tables with a weight column (see reweighting.py) are filled with their weights: histograms
+# and efficiencies sum the weights, means are weighted means, the error bars use the
+# effective number of entries.
+
 # List of available functions:
+# - setup_style
+# - close_figures
+# - set_render_profile
+# - set_uncertainty
+# - cms_label
+# - write_contact_sheet
 # - sanitize_filename
 # - shorten_labels
-# - histogram_1D_comparison
-# - histogram_2D
+# - save_plot_data
+# - replot_from_data
+# - bin_sums
+# - calculate_efficiency
+# - calculate_efficiency_ptCuts
+# - fit_efficiencies
+# - histogram_1D_comparison / draw_histogram_1D_comparison
+# - histogram_2D / draw_histogram_2D
 # - calculate_mean
-# - plot_mean_comparison
-# - plot_efficiency_comparison
-# - plot_efficiency_ptCuts_single_dataset
-# - plot_3_eta_ranges
+# - plot_mean_comparison / draw_mean_comparison
+# - plot_efficiency_comparison / draw_efficiency_comparison
+# - plot_efficiency_ptCuts_single_dataset / draw_efficiency_ptCuts_single_dataset
+# - select_eta_region
+# - plot_3_eta_ranges / draw_3_eta_ranges
+# - plot_rate_comparison / draw_rate_comparison
+# - plot_rate_vs_efficiency / draw_rate_vs_efficiency
+
+# Import matplotlib / mplhep and apply the style, once, before the first figure
+def setup_style():
+    global plt, hep, LogNorm
+    if plt is not None:
+        return
+    import matplotlib.pyplot as pyplot
+    import mplhep
+    from matplotlib.colors import LogNorm as log_norm
+
+    mplhep.style.use("CMS")
+    pyplot.rcParams.update(params)
+    plt, hep, LogNorm = pyplot, mplhep, log_norm
+
+
+def close_figures():
+    if plt is not None:
+        plt.close('all')
+
+
+# Switch the render profile for all the following figures, single settings can be overridden
+def set_render_profile(name='publication', **settings):
+    render_profile.clear()
+    render_profile.update(render_profiles[name], name=name)
+    render_profile.update(settings)
+
+
+def set_uncertainty(**settings):
+    for key in settings:
+        if key not in uncertainty:
+            raise ValueError(f"Unknown uncertainty setting '{key}', available: {sorted(uncertainty)}")
+    uncertainty.update(settings)
+
+
+# CMS label (skipped in the preview profile)
+def cms_label(fontsize):
+    if render_profile['cms_label']:
+        hep.cms.text("Private", fontsize=fontsize)
+
+
+# HTML page with thumbnails of the figures, to look through a run without opening every file
+def write_contact_sheet(fig_names, filename, title='Figures'):
+    directory = os.path.dirname(os.path.abspath(filename))
+    cells = []
+    for fig_name in fig_names:
+        relative = os.path.relpath(os.path.abspath(fig_name), directory)
+        caption = html.escape(os.path.splitext(os.path.basename(fig_name))[0])
+        cells.append(f'<figure><a href="{html.escape(relative)}"><img src="{html.escape(relative)}" loading="lazy"></a>'
+                     f'<figcaption>{caption}</figcaption></figure>')
+    with open(filename, 'w') as f:
+        f.write(f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{html.escape(title)}</title>\n'
+                '<style>body{font-family:sans-serif} figure{display:inline-block;width:320px;margin:6px;vertical-align:top}'
+                ' img{width:100%;border:1px solid #ccc} figcaption{font-size:11px;word-wrap:break-word}</style></head>\n'
+                f'<body><h2>{html.escape(title)}</h2>\n' + '\n'.join(cells) + '\n</body></html>\n')
+    return filename
+
 
 # Make a filename with only alphanumeric characters
 def sanitize_filename(filename):
@@ -51,213 +144,537 @@ def shorten_labels(labels):
     return shortened
 
 
+# Save the arrays behind a figure next to it (same name, .npz) with the options needed to draw it again
+def save_plot_data(fig_name, function, arrays, options):
+    data_name = os.path.splitext(fig_name)[0] + '.npz'
+    np.savez_compressed(data_name, _function=function, _options=json.dumps(options), **arrays)
+    return data_name
+
+
+# Suffix of a redrawn figure: none with the publication settings (any format), else _<profile>,
+# so that e.g. a preview replot does not replace the figure of the campaign run
+def _replot_suffix():
+    settings = {key: value for key, value in render_profile.items() if key not in ('name', 'format')}
+    publication = {key: value for key, value in render_profiles['publication'].items() if key != 'format'}
+    return '' if settings == publication else f"_{render_profile['name']}"
+
+
+# Redraw a figure from its .npz file without touching the ROOT files, options (labels, titles, ...) can be overridden
+def replot_from_data(data_name, **overrides):
+    with np.load(data_name) as stored:
+        function = str(stored['_function'])
+        options = json.loads(str(stored['_options']))
+        arrays = {key: stored[key] for key in stored.files if not key.startswith('_')}
+    options.update(overrides)
+
+    draw_functions[function](arrays, options)
+    fig_name = os.path.splitext(data_name)[0] + _replot_suffix() + '.' + render_profile['format']
+    plt.savefig(fig_name, dpi=render_profile['dpi'])
+    close_figures()
+    return fig_name
+
+
+# Save the figure (and its data, and its turn-on fits as <name>_fits.csv) under the sanitized title
+def _save_figure(fig_path, sanitized_title, save_data, function, arrays, options):
+    fig_name = os.path.join(fig_path, sanitized_title + '.' + render_profile['format'])
+    plt.savefig(fig_name, dpi=render_profile['dpi'])
+    if save_data:
+        save_plot_data(fig_name, function, arrays, options)
+    if options.get('fit'):
+        fits = {'params': arrays['fit_params'], 'errors': arrays['fit_errors'], 'chi2': arrays['fit_chi2'],
+                'ndf': arrays['fit_ndf'], 'converged': arrays['fit_converged']}
+        turn_on.write_fit_table(os.path.join(fig_path, sanitized_title + '_fits.csv'),
+                                turn_on.fit_rows(fits, options['fit_labels'], options['fit'], plot=sanitized_title))
+    return fig_name
+
+
+# Sum of the weights and of the squared weights in each bin, from the bin index of every row
+# (unc.bin_indices, -1 is skipped); unweighted rows count 1 and both sums are the counts
+def bin_sums(index, n_bins, weights=None):
+    inside = index >= 0
+    if weights is None:
+        counts = np.bincount(index[inside], minlength=n_bins)
+        return counts, counts
+    weights = weights[inside]
+    return np.bincount(index[inside], weights, n_bins), np.bincount(index[inside], weights**2, n_bins)
+
+
+# Efficiency and its (down, up) errors from numerator and denominator histograms, see uncertainty;
+# for weighted histograms squares_denominator (sum of w^2) gives the effective counts of the errors
+def calculate_efficiency(counts_numerator, counts_denominator, squares_denominator=None):
+    with np.errstate(divide='ignore', invalid='ignore'):  
+        eff = np.nan_to_num(counts_numerator / counts_denominator, nan=0.0)
+    if squares_denominator is not None:
+        counts_numerator, counts_denominator = unc.effective_counts(counts_numerator, counts_denominator, squares_denominator)
+    eff_err = unc.efficiency_errors(eff, counts_numerator, counts_denominator, uncertainty['efficiency'], uncertainty['confidence'],
+                                    uncertainty['n_replicas'], uncertainty['seed'])
+    return eff, eff_err
+
+
+# Efficiencies for different ptCuts (rows) in the bins of column, the rows are binned once
+def calculate_efficiency_ptCuts(data_numerator, data_denominator, column, bins, ptCuts):
+    n_bins = len(bins) - 1
+    weights_denominator = rw.row_weights(data_denominator)
+    counts_denominator, squares_denominator = bin_sums(unc.bin_indices(data_denominator[column], bins), n_bins, weights_denominator)
+    index = unc.bin_indices(data_numerator[column], bins)
+    inside = index >= 0
+    index = index[inside]
+    pt = data_numerator['theL1Obj.pt'].to_numpy(dtype=float)[inside]
+    weights = rw.row_weights(data_numerator)
+    weights = 1.0 if weights is None else weights[inside]
+    effs, eff_errs = [], []
+    for ptCut in ptCuts:
+        # the passing rows are selected by their weight (0 or w), no copies of the rows per cut
+        counts_numerator = np.bincount(index, (pt >= ptCut) * weights, n_bins)
+        eff, eff_err = calculate_efficiency(counts_numerator, counts_denominator, None if weights_denominator is None else squares_denominator)
+        effs.append(eff)
+        eff_errs.append(eff_err)
+    return np.array(effs), np.array(eff_errs)
+
+
+# Fit turn-on curves (fit = 'erf' or 'sigmoid') to the efficiency rows, all in one batch,
+# the results are kept with the plot arrays and drawn over the points
+def fit_efficiencies(arrays, options, eff, eff_err, labels, fit):
+    fits = turn_on.fit_turn_ons(arrays['bin_centers'], eff, eff_err, fit)
+    arrays.update(fit_params=fits['params'], fit_errors=fits['errors'], fit_chi2=fits['chi2'],
+                  fit_ndf=fits['ndf'], fit_converged=fits['converged'])
+    options.update(fit=fit, fit_labels=list(labels))
+
+
+# Fitted turn-on curves, in the colors of the points they were fitted to
+def _draw_turn_on_fits(arrays, options, linewidth=3):
+    x = np.linspace(arrays['bin_centers'][0], arrays['bin_centers'][-1], 500)
+    for i, params in enumerate(arrays['fit_params']):
+        if np.all(np.isfinite(params)):
+            plt.plot(x, turn_on.turn_on_curve(x, params, options['fit'])[0], color=colors[i % len(colors)], linestyle='--', linewidth=linewidth)
+
+
 # Plot 1D histogram with comparison of multiple datasets
-def histogram_1D_comparison(datasets, dataset_labels, column, bins, xlabel, ylabel, title, fig_path, save=False, range=None):
+def histogram_1D_comparison(datasets, dataset_labels, column, bins, xlabel, ylabel, title, fig_path, save=False, range=None, save_data=False):
+    with ins.stage('fill', rows_in=sum(len(data) for data in datasets)):
+        counts = []
+        for data in datasets:
+            h, edges = np.histogram(data[column], bins=bins, range=range, weights=rw.row_weights(data))
+            counts.append(h)
+        arrays = {'edges': edges, 'counts': np.array(counts)}
+        options = {'dataset_labels': list(dataset_labels), 'xlabel': xlabel, 'ylabel': ylabel, 'title': title}
+
+    with ins.stage('render'):
+        draw_histogram_1D_comparison(arrays, options)
+
+        if save:
+            short_labels = shorten_labels(dataset_labels)
+            sanitized_title = sanitize_filename(f"{title}_{ylabel}_{xlabel}{'_'.join(short_labels)}")
+            return _save_figure(fig_path, sanitized_title, save_data, 'histogram_1D_comparison', arrays, options)
+        else:
+            # plt.show()
+            print('')
+
+
+def draw_histogram_1D_comparison(arrays, options):
+    setup_style()
     plt.figure(figsize=(20, 15))
+    edges = arrays['edges']
     
-    for i, data in enumerate(datasets):
-        plt.hist(data[column], bins=bins, histtype='step', color=colors[i % len(colors)], linewidth=params['patch.linewidth'], range=range, label=dataset_labels[i])
+    for i, counts in enumerate(arrays['counts']):
+        plt.hist(edges[:-1], bins=edges, weights=counts, histtype='step', color=colors[i % len(colors)], linewidth=params['patch.linewidth'], label=options['dataset_labels'][i])
     
-    plt.xlabel(xlabel)
-    plt.ylabel(ylabel)
-    plt.title(f"{title}")
+    plt.xlabel(options['xlabel'])
+    plt.ylabel(options['ylabel'])
+    plt.title(f"{options['title']}")
     plt.legend()
     plt.grid(True)
     
-    hep.cms.text("Private", fontsize=40)
-
-    if save:
-        short_labels = shorten_labels(dataset_labels)
-        sanitized_title = sanitize_filename(f"{title}_{ylabel}_{xlabel}{'_'.join(short_labels)}")
-        plt.savefig(os.path.join(fig_path, sanitized_title + '.png'))
-    else:
-        # plt.show()
-        print('')
+    cms_label(fontsize=40)
 
 
 # Plot 2D histogram 
-def histogram_2D(data, column1, column2, bins, xlabel, ylabel, title, fig_path, save=False, log_scale=False, range=None):
+def histogram_2D(data, column1, column2, bins, xlabel, ylabel, title, fig_path, save=False, log_scale=False, range=None, save_data=False):
+    with ins.stage('fill', rows_in=len(data)):
+        counts, xedges, yedges = np.histogram2d(data[column1], data[column2], bins=bins, range=range, weights=rw.row_weights(data))
+        arrays = {'counts': counts, 'xedges': xedges, 'yedges': yedges}
+        options = {'xlabel': xlabel, 'ylabel': ylabel, 'title': title, 'log_scale': log_scale}
+
+    with ins.stage('render'):
+        draw_histogram_2D(arrays, options)
+
+        if save:
+            sanitized_title = sanitize_filename(f"{title}_{ylabel}")
+            return _save_figure(fig_path, sanitized_title, save_data, 'histogram_2D', arrays, options)
+        else:   
+            # plt.show()
+            print('')
+
+
+def draw_histogram_2D(arrays, options):
+    setup_style()
     plt.figure(figsize=(20, 15))
-    if log_scale:
-        h = plt.hist2d(data[column1], data[column2], bins=bins, norm=LogNorm(), range=range)
-        plt.colorbar(h[3], ax=plt.gca())
+    xedges, yedges = arrays['xedges'], arrays['yedges']
+    if options['log_scale']:
+        h = plt.pcolormesh(xedges, yedges, arrays['counts'].T, norm=LogNorm())
+        plt.colorbar(h, ax=plt.gca())
     else:
-        plt.hist2d(data[column1], data[column2], bins=bins, range=range)
-    plt.xlabel(xlabel)
-    plt.ylabel(ylabel)
-    plt.title(f"{title}")
+        plt.pcolormesh(xedges, yedges, arrays['counts'].T)
+    plt.xlim(xedges[0], xedges[-1])
+    plt.ylim(yedges[0], yedges[-1])
+    plt.xlabel(options['xlabel'])
+    plt.ylabel(options['ylabel'])
+    plt.title(f"{options['title']}")
     
-    hep.cms.text("Private", fontsize=40)
-
-    if save:
-        sanitized_title = sanitize_filename(f"{title}_{ylabel}")
-        plt.savefig(os.path.join(fig_path, sanitized_title + '.png'))
-    else:   
-        # plt.show()
-        print('')
+    cms_label(fontsize=40)
 
 
 # Calculate mean values for histogram bins
 def calculate_mean(data, column1, column2, bins):
-    data['bin'] = pd.cut(data[column1], bins=bins)
-    mean_values = (data.groupby('bin', observed=False)[column2]).mean()
-    std_errors = (data.groupby('bin', observed=False)[column2]).sem()
+    weights = rw.row_weights(data)
+    if weights is not None:
+        mean_values, std_errors = _weighted_mean(data, column1, column2, bins, weights)
+    else:
+        import pandas as pd
+        # the bins are not written into data, which may be a shared selection
+        grouped = data.groupby(pd.cut(data[column1], bins=bins), observed=False)[column2]
+        mean_values = grouped.mean()
+        std_errors = grouped.sem()
+    if uncertainty['mean'] == 'bootstrap':
+        std_errors = unc.bootstrap_mean(data[column1], data[column2], bins, weights, n_replicas=uncertainty['n_replicas'], seed=uncertainty['seed'])
     bin_centers = 0.5 * (bins[:-1] + bins[1:])
     return bin_centers, mean_values, std_errors
 
 
+# Weighted mean of column2 in the bins of column1 (same binning as pd.cut) and its standard
+# error: the weighted standard deviation over the square root of the effective entries
+def _weighted_mean(data, column1, column2, bins, weights):
+    n_bins = len(bins) - 1
+    index = unc.bin_indices(data[column1], bins, right=True)
+    values = data[column2].to_numpy(dtype=float)
+    valid = ~np.isnan(values)
+    index, values, weights = index[valid], values[valid], weights[valid]
+    sum_w, sum_w2 = bin_sums(index, n_bins, weights)
+    inside = index >= 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_values = np.bincount(index[inside], weights[inside] * values[inside], n_bins) / sum_w
+        deviations = values[inside] - mean_values[index[inside]]
+        variance = np.bincount(index[inside], weights[inside] * deviations**2, n_bins) / (sum_w - sum_w2 / sum_w)
+        std_errors = np.sqrt(variance * sum_w2) / sum_w
+    return mean_values, std_errors
+
+
 # Plot mean values with error bars for comparison of multiple datasets
-def plot_mean_comparison(datasets, dataset_labels, column1, column2, bins, xlabel, ylabel, title, fig_path, save=False,density=False,log=False):
-    plt.figure(figsize=(20, 15))
-    
-    for i, data in enumerate(datasets):
-        # print('Dataset:', dataset_labels[i])
-        bin_centers, mean_values, std_errors = calculate_mean(data, column1, column2, bins)
-        # print('Bin centers:', bin_centers)
-        # print('Mean values:', mean_values)  
-        plt.errorbar(bin_centers, mean_values, yerr=std_errors, fmt='o', markersize=10, color=colors[i % len(colors)], ecolor=colors[i % len(colors)], capsize=5, linestyle='None', linewidth=2, label=dataset_labels[i])
-    
+def plot_mean_comparison(datasets, dataset_labels, column1, column2, bins, xlabel, ylabel, title, fig_path, save=False,density=False,log=False, save_data=False):
+    with ins.stage('fill', rows_in=sum(len(data) for data in datasets)):
+        means, errors = [], []
+        for data in datasets:
+            bin_centers, mean_values, std_errors = calculate_mean(data, column1, column2, bins)
+            means.append(np.asarray(mean_values, dtype=float))
+            errors.append(np.asarray(std_errors, dtype=float))
+        arrays = {'bins': np.asarray(bins), 'bin_centers': bin_centers, 'means': np.array(means), 'std_errors': np.array(errors)}
+        options = {'dataset_labels': list(dataset_labels), 'xlabel': xlabel, 'ylabel': ylabel, 'title': title, 'density': density, 'log': log}
+
+    with ins.stage('render'):
+        draw_mean_comparison(arrays, options)
+
+        if save:
+            short_labels = shorten_labels(dataset_labels)
+            sanitized_title = sanitize_filename(f"{title}_{ylabel}_{'_'.join(short_labels)}")
+            return _save_figure(fig_path, sanitized_title, save_data, 'plot_mean_comparison', arrays, options)
+        else:
+            # plt.show()
+            print('')
 
 
+def draw_mean_comparison(arrays, options):
+    setup_style()
+    plt.figure(figsize=(20, 15))
+    
+    for i, (mean_values, std_errors) in enumerate(zip(arrays['means'], arrays['std_errors'])):
+        plt.errorbar(arrays['bin_centers'], mean_values, yerr=std_errors, fmt='o', markersize=10, color=colors[i % len(colors)], ecolor=colors[i % len(colors)], capsize=5, linestyle='None', linewidth=2, label=options['dataset_labels'][i])
 
-    plt.xlabel(xlabel)
-    plt.ylabel(ylabel)
-    plt.title(f"{title}")
+    plt.xlabel(options['xlabel'])
+    plt.ylabel(options['ylabel'])
+    plt.title(f"{options['title']}")
 
-    if log:
+    if options['log']:
         plt.xscale('log')
-        plt.xlim(1, bins[-1])
+        plt.xlim(1, arrays['bins'][-1])
         plt.ylim(0, 3.5)
-    if density:
+    if options['density']:
         plt.ylim(-0.02, 1.05)
     
     plt.legend()
     plt.grid(True)
     
-    hep.cms.text("Private", fontsize=30)
+    cms_label(fontsize=30)
 
-    if save:
-        short_labels = shorten_labels(dataset_labels)
-        sanitized_title = sanitize_filename(f"{title}_{ylabel}_{'_'.join(short_labels)}")
-        plt.savefig(os.path.join(fig_path, sanitized_title + '.png'))
-    else:
-        # plt.show()
-        print('')
 
 # Plot efficiency comparison of multiple datasets
 def plot_efficiency_comparison(datasets_numerator, datasets_denominator, dataset_labels, column, bins, 
-                               xlabel, ylabel, title, fig_path, save=False, ptCut=0):
-    plt.figure(figsize=(20, 15))
-    
-    for i, (data_num, data_den) in enumerate(zip(datasets_numerator, datasets_denominator)):
-        filtered_data_num = data_num[data_num['theL1Obj.pt'] >= ptCut]
-        hist1 = np.histogram(filtered_data_num[column], bins=bins)
-        hist2 = np.histogram(data_den[column], bins=bins)
-        with np.errstate(divide='ignore', invalid='ignore'):  
-            eff = np.nan_to_num(hist1[0] / hist2[0], nan=0.0)
-            eff_err = np.sqrt(eff * (1 - eff) / np.where(hist2[0] > 0, hist2[0], 1))
+                               xlabel, ylabel, title, fig_path, save=False, ptCut=0, save_data=False, fit=None):
+    with ins.stage('fill', rows_in=sum(len(data) for data in list(datasets_numerator) + list(datasets_denominator))):
+        effs, eff_errs = [], []
+        for data_num, data_den in zip(datasets_numerator, datasets_denominator):
+            eff, eff_err = calculate_efficiency_ptCuts(data_num, data_den, column, bins, [ptCut])
+            effs.append(eff[0])
+            eff_errs.append(eff_err[0])
         bin_centers = 0.5 * (bins[1:] + bins[:-1])
+        arrays = {'bin_centers': bin_centers, 'eff': np.array(effs), 'eff_err': np.array(eff_errs)}
+        options = {'dataset_labels': list(dataset_labels), 'xlabel': xlabel, 'ylabel': ylabel, 'title': title, 'ptCut': ptCut}
+        if fit:
+            fit_efficiencies(arrays, options, arrays['eff'], arrays['eff_err'], [f'{label} pT>={ptCut}' for label in dataset_labels], fit)
+
+    with ins.stage('render'):
+        draw_efficiency_comparison(arrays, options)
+
+        if save:
+            short_labels = shorten_labels(dataset_labels)
+            sanitized_title = sanitize_filename(f"{title}_{ylabel}_{'_'.join(short_labels)}")
+            return _save_figure(fig_path, sanitized_title, save_data, 'plot_efficiency_comparison', arrays, options)
+        else:
+            # plt.show()
+            print('')
+
 
-        plt.errorbar(bin_centers, eff, yerr=eff_err, fmt='o', markersize=10, color=colors[i % len(colors)], ecolor=colors[i % len(colors)], capsize=5, linestyle='None', linewidth=2, label=dataset_labels[i])
+def draw_efficiency_comparison(arrays, options):
+    setup_style()
+    plt.figure(figsize=(20, 15))
+    ptCut = options['ptCut']
+    
+    for i, (eff, eff_err) in enumerate(zip(arrays['eff'], arrays['eff_err'])):
+        plt.errorbar(arrays['bin_centers'], eff, yerr=eff_err, fmt='o', markersize=10, color=colors[i % len(colors)], ecolor=colors[i % len(colors)], capsize=5, linestyle='None', linewidth=2, label=options['dataset_labels'][i])
+    if options.get('fit'):
+        _draw_turn_on_fits(arrays, options)
     
     # Add vertical line for ptCut
     plt.axvline(ptCut, color='black', linestyle='--', linewidth=2, label=f'$p_T$ cut: {ptCut} GeV')
 
     plt.xscale('log')  # Set x-axis to log scale
-    plt.xlabel(xlabel)
-    plt.ylabel(ylabel)
+    plt.xlabel(options['xlabel'])
+    plt.ylabel(options['ylabel'])
     plt.ylim(-0.02, 1.05)
-    plt.title(f"{title}")
+    plt.title(f"{options['title']}")
     plt.legend()
     plt.grid(True, which="both", linestyle='--', linewidth=0.5)
     
-    hep.cms.text("Private", fontsize=30)
-
-    if save:
-        short_labels = shorten_labels(dataset_labels)
-        sanitized_title = sanitize_filename(f"{title}_{ylabel}_{'_'.join(short_labels)}")
-        plt.savefig(os.path.join(fig_path, sanitized_title + '.png'))
-    else:
-        # plt.show()
-        print('')
+    cms_label(fontsize=30)
 
 
 
 # Plot efficiency for one dataset, different ptCuts
 
-def plot_efficiency_ptCuts_single_dataset(data_numerator, data_denominator, dataset_label, column, bins, xlabel, ylabel, title, fig_path, save=False, ptCuts=[0]):
-    if save==True:
-        plt.figure(figsize=(20, 15))
-    
-    for i, ptCut in enumerate(ptCuts):
-        hist1 = np.histogram(data_numerator[data_numerator['theL1Obj.pt'] >= ptCut][column], bins=bins)
-        hist2 = np.histogram(data_denominator[column], bins=bins)
-
-        with np.errstate(divide='ignore', invalid='ignore'):  
-            eff = np.nan_to_num(hist1[0] / hist2[0], nan=0.0)
-            eff_err = np.sqrt(eff * (1 - eff) / np.where(hist2[0] > 0, hist2[0], 1))
+def plot_efficiency_ptCuts_single_dataset(data_numerator, data_denominator, dataset_label, column, bins, xlabel, ylabel, title, fig_path, save=False, ptCuts=[0], save_data=False, fit=None):
+    with ins.stage('fill', rows_in=len(data_numerator) + len(data_denominator)):
+        eff, eff_err = calculate_efficiency_ptCuts(data_numerator, data_denominator, column, bins, ptCuts)
         bin_centers = 0.5 * (bins[1:] + bins[:-1])
+        arrays = {'bin_centers': bin_centers, 'eff': eff, 'eff_err': eff_err}
+        options = {'dataset_label': dataset_label, 'xlabel': xlabel, 'ylabel': ylabel, 'title': title, 'ptCuts': list(ptCuts)}
+        if fit:
+            fit_efficiencies(arrays, options, eff, eff_err, [f'{dataset_label} pT>={ptCut}' for ptCut in ptCuts], fit)
+
+    with ins.stage('render'):
+        draw_efficiency_ptCuts_single_dataset(arrays, options, standalone=save)
+
+        if save:
+            short_label = shorten_labels([dataset_label])
+            sanitized_title = sanitize_filename(f"{title}_{ylabel}_ptCuts_{short_label}")
+            return _save_figure(fig_path, sanitized_title, save_data, 'plot_efficiency_ptCuts_single_dataset', arrays, options)
 
-        label_text = f'$p_T$ cut: {ptCut} GeV' if ptCut != 0 else 'No $p_T$ cut'
-        plt.errorbar(bin_centers, eff, yerr=eff_err, fmt='o', markersize=10, color=colors[i % len(colors)], ecolor=colors[i % len(colors)], capsize=5, linestyle='None', linewidth=2, label=label_text)
 
-    if save:
-        plt.xlabel(xlabel)
-        plt.ylabel(ylabel)
-        plt.title(f"{title}  {dataset_label}")
+# standalone=False draws into the current axes (used for the panels of plot_3_eta_ranges)
+def draw_efficiency_ptCuts_single_dataset(arrays, options, standalone=True):
+    setup_style()
+    if standalone:
+        plt.figure(figsize=(20, 15))
+    
+    for i, ptCut in enumerate(options['ptCuts']):
+        label_text = f'$p_T$ cut: {ptCut} GeV' if ptCut != 0 else 'No $p_T$ cut'
+        plt.errorbar(arrays['bin_centers'], arrays['eff'][i], yerr=arrays['eff_err'][i], fmt='o', markersize=10, color=colors[i % len(colors)], ecolor=colors[i % len(colors)], capsize=5, linestyle='None', linewidth=2, label=label_text)
+    if options.get('fit'):
+        _draw_turn_on_fits(arrays, options, linewidth=3 if standalone else 5)
+
+    if standalone:
+        plt.xlabel(options['xlabel'])
+        plt.ylabel(options['ylabel'])
+        plt.title(f"{options['title']}  {options['dataset_label']}")
         plt.ylim(-0.02, 1.05)
         plt.legend()
         plt.grid(True) 
-        hep.cms.text("Private", fontsize=30)
-        short_label = shorten_labels([dataset_label])
-        sanitized_title = sanitize_filename(f"{title}_{ylabel}_ptCuts_{short_label}")
-        plt.savefig(os.path.join(fig_path, sanitized_title + '.png'))
+        cms_label(fontsize=30)
     else:
-        plt.xlabel(xlabel, fontsize=100)
-        plt.ylabel(ylabel, fontsize=100)
-        plt.title(f"{title}  {dataset_label}", fontsize=60)
-        hep.cms.text("Private", fontsize=50)
+        plt.xlabel(options['xlabel'], fontsize=100)
+        plt.ylabel(options['ylabel'], fontsize=100)
+        plt.title(f"{options['title']}  {options['dataset_label']}", fontsize=60)
+        cms_label(fontsize=50)
         plt.ylim(-0.02, 1.05)
         plt.legend(fontsize=50)
         plt.grid(True)
 
 
-def plot_3_eta_ranges(data_numerator, data_denominator, dataset_label, column, bins, xlabel, ylabel, title, fig_path, save=False, ptCuts=[0]):
+# Muon track finder regions in |gen eta|: BMTF < 0.83 <= OMTF <= 1.24 < EMTF <= 2.4
+eta_regions = ['BMTF', 'OMTF', 'EMTF']
+
+
+def select_eta_region(data, region):
+    if region not in eta_regions:
+        raise ValueError(f"Unknown eta region '{region}', available: {eta_regions}")
+    abs_eta = abs(data['theColl._eta'])
+    if region == 'BMTF':
+        return data[abs_eta < 0.83]
+    if region == 'OMTF':
+        return data[(abs_eta >= 0.83) & (abs_eta <= 1.24)]
+    return data[(abs_eta > 1.24) & (abs_eta <= 2.4)]
+
+
+def plot_3_eta_ranges(data_numerator, data_denominator, dataset_label, column, bins, xlabel, ylabel, title, fig_path, save=False, ptCuts=[0], save_data=False, fit=None):
+    with ins.stage('fill', rows_in=len(data_numerator) + len(data_denominator)):
+        arrays = {'bin_centers': 0.5 * (bins[1:] + bins[:-1])}
+        for region in eta_regions:
+            arrays[f'eff_{region}'], arrays[f'eff_err_{region}'] = calculate_efficiency_ptCuts(
+                select_eta_region(data_numerator, region), select_eta_region(data_denominator, region), column, bins, ptCuts)
+        options = {'dataset_label': dataset_label, 'xlabel': xlabel, 'ylabel': ylabel, 'title': title, 'ptCuts': list(ptCuts)}
+        if fit:
+            # one batch for all the regions, the fit_* rows are region after region
+            fit_efficiencies(arrays, options, np.concatenate([arrays[f'eff_{region}'] for region in eta_regions]),
+                             np.concatenate([arrays[f'eff_err_{region}'] for region in eta_regions]),
+                             [f'{dataset_label} {region} pT>={ptCut}' for region in eta_regions for ptCut in ptCuts], fit)
+
+    with ins.stage('render'):
+        draw_3_eta_ranges(arrays, options)
+
+        if save:
+            short_label = shorten_labels([dataset_label])
+            sanitized_title = sanitize_filename(f"{title}_{ylabel}_{short_label}_3plots")
+            return _save_figure(fig_path, sanitized_title, save_data, 'plot_3_eta_ranges', arrays, options)
+        else:
+            # plt.show() 
+            print('')
+
+
+def draw_3_eta_ranges(arrays, options):
+    setup_style()
     fig, axs = plt.subplots(1, 3, figsize=(50, 20))  
 
-    filtered_numerator_BMTF = data_numerator[abs(data_numerator['theColl._eta']) < 0.83]
-    filtered_denominator_BMTF = data_denominator[abs(data_denominator['theColl._eta']) < 0.83]
+    n_cuts = len(options['ptCuts'])
+    for r, (ax, region) in enumerate(zip(axs, eta_regions)):
+        plt.sca(ax)
+        region_arrays = {'bin_centers': arrays['bin_centers'], 'eff': arrays[f'eff_{region}'], 'eff_err': arrays[f'eff_err_{region}']}
+        if options.get('fit'):
+            region_arrays['fit_params'] = arrays['fit_params'][r * n_cuts:(r + 1) * n_cuts]
+        region_options = dict(options, dataset_label=region, title='')
+        draw_efficiency_ptCuts_single_dataset(region_arrays, region_options, standalone=False)
+
+    plt.suptitle(f"{options['title']} - {options['dataset_label']}", fontsize=70) 
+
+    for ax in axs:
+        ax.set_xlabel(options['xlabel'], fontsize=70)  
+        ax.set_ylabel(options['ylabel'], fontsize=60) 
+        ax.tick_params(axis='both', which='major', labelsize=50)  
 
-    filtered_numerator_OMTF = data_numerator[(abs(data_numerator['theColl._eta']) >= 0.83) & (abs(data_numerator['theColl._eta']) <= 1.24)]
-    filtered_denominator_OMTF = data_denominator[(abs(data_denominator['theColl._eta']) >= 0.83) & (abs(data_denominator['theColl._eta']) <= 1.24)]
+    if render_profile['tight_layout']:
+        plt.tight_layout()
 
-    filtered_numerator_EMTF = data_numerator[(abs(data_numerator['theColl._eta']) > 1.24) & (abs(data_numerator['theColl._eta']) <= 2.4)]
-    filtered_denominator_EMTF = data_denominator[(abs(data_denominator['theColl._eta']) > 1.24) & (abs(data_denominator['theColl._eta']) <= 2.4)]
 
-    plt.sca(axs[0])
-    plot_efficiency_ptCuts_single_dataset(filtered_numerator_BMTF, filtered_denominator_BMTF, 'BMTF', column, bins, xlabel, ylabel, '', fig_path, save=False, ptCuts=ptCuts)
+# Number of events of every dataset (one number for all of them is fine too)
+def _events_per_dataset(n_events, datasets):
+    return list(n_events) if np.ndim(n_events) else [n_events] * len(datasets)
 
-    plt.sca(axs[1])
-    plot_efficiency_ptCuts_single_dataset(filtered_numerator_OMTF, filtered_denominator_OMTF, 'OMTF', column, bins, xlabel, ylabel, '', fig_path, save=False, ptCuts=ptCuts)
 
-    plt.sca(axs[2])
-    plot_efficiency_ptCuts_single_dataset(filtered_numerator_EMTF, filtered_denominator_EMTF, 'EMTF', column, bins, xlabel, ylabel, '', fig_path, save=False, ptCuts=ptCuts)
+# Plot trigger rate vs pT threshold (the bins): fraction of events with a candidate at or above
+# the threshold (times scale, e.g. rates.LHC_COLLISION_RATE_HZ), datasets are L1 candidate tables
+def plot_rate_comparison(datasets, dataset_labels, n_events, bins, xlabel, ylabel, title, fig_path, save=False, scale=1.0, log=True, save_data=False):
+    with ins.stage('fill', rows_in=sum(len(data) for data in datasets)):
+        rate_values, rate_errs = [], []
+        for data, events in zip(datasets, _events_per_dataset(n_events, datasets)):
+            rate, rate_err = rates.candidate_rates(data, events, bins, uncertainty['confidence'])
+            rate_values.append(rate * scale)
+            rate_errs.append(rate_err * scale)
+        arrays = {'thresholds': np.asarray(bins, dtype=float), 'rate': np.array(rate_values), 'rate_err': np.array(rate_errs)}
+        options = {'dataset_labels': list(dataset_labels), 'xlabel': xlabel, 'ylabel': ylabel, 'title': title, 'log': log}
 
-    plt.suptitle(f"{title} - {dataset_label}", fontsize=70) 
+    with ins.stage('render'):
+        draw_rate_comparison(arrays, options)
 
-    for ax in axs:
-        ax.set_xlabel(xlabel, fontsize=70)  
-        ax.set_ylabel(ylabel, fontsize=60) 
-        ax.tick_params(axis='both', which='major', labelsize=50)  
+        if save:
+            short_labels = shorten_labels(dataset_labels)
+            sanitized_title = sanitize_filename(f"{title}_{ylabel}_rate_{'_'.join(short_labels)}")
+            return _save_figure(fig_path, sanitized_title, save_data, 'plot_rate_comparison', arrays, options)
 
-    plt.tight_layout()
 
-    if save:
-        short_label = shorten_labels([dataset_label])
-        sanitized_title = sanitize_filename(f"{title}_{ylabel}_{short_label}_3plots")
-        plt.savefig(os.path.join(fig_path, sanitized_title + '.png'))
-    else:
-        # plt.show() 
-        print('')
+def draw_rate_comparison(arrays, options):
+    setup_style()
+    plt.figure(figsize=(20, 15))
+
+    for i, (rate, rate_err) in enumerate(zip(arrays['rate'], arrays['rate_err'])):
+        plt.errorbar(arrays['thresholds'], rate, yerr=rate_err, fmt='o', markersize=10, color=colors[i % len(colors)], ecolor=colors[i % len(colors)], capsize=5, linestyle='None', linewidth=2, label=options['dataset_labels'][i])
+
+    if options['log']:
+        plt.yscale('log')
+    plt.xlabel(options['xlabel'])
+    plt.ylabel(options['ylabel'])
+    plt.title(f"{options['title']}")
+    plt.legend()
+    plt.grid(True, which="both", linestyle='--', linewidth=0.5)
+
+    cms_label(fontsize=30)
+
+
+# Plot rate vs efficiency, one point per pT threshold (the bins): rate from the L1 candidate tables
+# (datasets), efficiency of the matched candidates (datasets_numerator) for the gen muons with
+# pT >= gen_pt_min (datasets_denominator); the thresholds in ptCuts are written next to their points
+def plot_rate_vs_efficiency(datasets, datasets_numerator, datasets_denominator, dataset_labels, n_events, bins, xlabel, ylabel, title, fig_path,
+                            save=False, gen_pt_min=0, scale=1.0, log=True, ptCuts=None, save_data=False):
+    with ins.stage('fill', rows_in=sum(len(data) for data in list(datasets) + list(datasets_numerator) + list(datasets_denominator))):
+        rate_values, rate_errs, effs, eff_errs = [], [], [], []
+        for data, data_num, data_den, events in zip(datasets, datasets_numerator, datasets_denominator, _events_per_dataset(n_events, datasets)):
+            rate, rate_err = rates.candidate_rates(data, events, bins, uncertainty['confidence'])
+            eff, eff_err = rates.efficiency_at_thresholds(data_num, data_den, bins, gen_pt_min, uncertainty['confidence'])
+            rate_values.append(rate * scale)
+            rate_errs.append(rate_err * scale)
+            effs.append(eff)
+            eff_errs.append(eff_err)
+        arrays = {'thresholds': np.asarray(bins, dtype=float), 'rate': np.array(rate_values), 'rate_err': np.array(rate_errs),
+                  'eff': np.array(effs), 'eff_err': np.array(eff_errs)}
+        options = {'dataset_labels': list(dataset_labels), 'xlabel': xlabel, 'ylabel': ylabel, 'title': title, 'log': log,
+                   'ptCuts': list(ptCuts or [])}
+
+    with ins.stage('render'):
+        draw_rate_vs_efficiency(arrays, options)
+
+        if save:
+            short_labels = shorten_labels(dataset_labels)
+            sanitized_title = sanitize_filename(f"{title}_{ylabel}_{xlabel}_rate_eff_{'_'.join(short_labels)}")
+            return _save_figure(fig_path, sanitized_title, save_data, 'plot_rate_vs_efficiency', arrays, options)
+
+
+def draw_rate_vs_efficiency(arrays, options):
+    setup_style()
+    plt.figure(figsize=(20, 15))
+
+    for i, (rate, rate_err, eff, eff_err) in enumerate(zip(arrays['rate'], arrays['rate_err'], arrays['eff'], arrays['eff_err'])):
+        plt.errorbar(eff, rate, xerr=eff_err, yerr=rate_err, fmt='o-', markersize=8, color=colors[i % len(colors)], ecolor=colors[i % len(colors)], capsize=3, linewidth=2, label=options['dataset_labels'][i])
+        for ptCut in options['ptCuts']:
+            j = np.searchsorted(arrays['thresholds'], ptCut)
+            if j < len(arrays['thresholds']) and arrays['thresholds'][j] == ptCut:
+                plt.annotate(f'{ptCut:g} GeV', (eff[j], rate[j]), textcoords='offset points', xytext=(10, 10), fontsize=20, color=colors[i % len(colors)])
+
+    if options['log']:
+        plt.yscale('log')
+    plt.xlim(-0.02, 1.05)
+    plt.xlabel(options['xlabel'])
+    plt.ylabel(options['ylabel'])
+    plt.title(f"{options['title']}")
+    plt.legend()
+    plt.grid(True, which="both", linestyle='--', linewidth=0.5)
+
+    cms_label(fontsize=30)
 
 
+# Drawing function of every plot type, used by replot_from_data
+draw_functions = {
+    'histogram_1D_comparison': draw_histogram_1D_comparison,
+    'histogram_2D': draw_histogram_2D,
+    'plot_mean_comparison': draw_mean_comparison,
+    'plot_efficiency_comparison': draw_efficiency_comparison,
+    'plot_efficiency_ptCuts_single_dataset': draw_efficiency_ptCuts_single_dataset,
+    'plot_3_eta_ranges': draw_3_eta_ranges,
+    'plot_rate_comparison': draw_rate_comparison,
+    'plot_rate_vs_efficiency': draw_rate_vs_efficiency,
+}
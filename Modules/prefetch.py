@@ -0,0 +1,66 @@
+import queue
+import threading
+
+# Background prefetching: the items of an iterator (e.g. the chunks of a ROOT tree, read and
+# decompressed by uproot) are produced in a thread and handed over through a bounded queue, so
+# chunk N+1 is read while chunk N is processed. At most `depth` items wait in the queue and, with
+# max_bytes, at most max_bytes of them (one item is always let through, however large), so the
+# memory held ahead of the consumer stays bounded.
+
+# List of available functions:
+# - prefetch
+
+
+# Iterate over items, produced up to depth items ahead in a background thread
+def prefetch(items, depth=2, max_bytes=None, nbytes=None):
+    if depth <= 0:
+        yield from items
+        return
+
+    waiting = queue.Queue(maxsize=depth)
+    budget = threading.Condition()
+    state = {'bytes': 0, 'stop': False}
+
+    def put(entry):
+        while not state['stop']:
+            try:
+                waiting.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                size = nbytes(item) if max_bytes and nbytes else 0
+                with budget:
+                    budget.wait_for(lambda: state['stop'] or state['bytes'] == 0 or state['bytes'] + size <= max_bytes)
+                    if state['stop']:
+                        return
+                    state['bytes'] += size
+                if not put(('item', item, size)):
+                    return
+            put(('done', None, 0))
+        except BaseException as error:
+            put(('error', error, 0))
+
+    producer = threading.Thread(target=produce, name='prefetch', daemon=True)
+    producer.start()
+    try:
+        while True:
+            kind, item, size = waiting.get()
+            if kind == 'done':
+                break
+            if kind == 'error':
+                raise item
+            with budget:
+                state['bytes'] -= size
+                budget.notify_all()
+            yield item
+    finally:
+        # Stop the producer also when the consumer gives up early
+        with budget:
+            state['stop'] = True
+            budget.notify_all()
+        producer.join()
@@ -0,0 +1,72 @@
+import numpy as np
+
+import uncertainties as unc
+import reweighting as rw
+
+# Trigger rates: the fraction of events with at least one L1 candidate at or above a pT threshold.
+# The leading candidate pT of every event comes from one segmented max over the event index
+# (np.maximum.reduceat over the candidates sorted by entry), and a reverse cumulative histogram
+# of the leading pT gives the rate for every threshold at once.
+# Multiply the fraction by a collision rate (e.g. LHC_COLLISION_RATE_HZ) to get a rate in Hz.
+# Rates count events and are not reweighted, efficiencies use the weights of weighted tables.
+
+# List of available functions:
+# - leading_pt
+# - rate_curve
+# - candidate_rates
+# - efficiency_at_thresholds
+
+# Bunch crossing rate x fraction of filled bunches
+LHC_COLLISION_RATE_HZ = 40e6 * 2760 / 3564
+
+
+# Highest candidate pT of every event which has candidates: (entries, leading pT)
+def leading_pt(entry, pt):
+    entry = np.asarray(entry)
+    pt = np.asarray(pt, dtype=float)
+    if len(entry) == 0:
+        return entry, pt
+    if np.any(entry[1:] < entry[:-1]):
+        order = np.argsort(entry, kind='stable')
+        entry, pt = entry[order], pt[order]
+    starts = np.flatnonzero(np.r_[True, entry[1:] != entry[:-1]])
+    return entry[starts], np.maximum.reduceat(pt, starts)
+
+
+# Fraction of the n_events with a leading pT >= each threshold, with (down, up) errors
+def rate_curve(leading, n_events, thresholds, confidence=0.683):
+    thresholds = np.asarray(thresholds, dtype=float)
+    counts = np.histogram(leading, bins=np.append(thresholds, np.inf))[0]
+    passing = np.cumsum(counts[::-1])[::-1]
+    fraction = passing / n_events
+    lower, upper = unc.clopper_pearson(passing, np.full(len(passing), n_events), confidence)
+    return fraction, unc.interval_errors(fraction, lower, upper)
+
+
+# Rate curve of a table of L1 candidates (columns entry and theL1Obj.pt)
+def candidate_rates(data, n_events, thresholds, confidence=0.683):
+    _, leading = leading_pt(data['entry'].to_numpy(), data['theL1Obj.pt'].to_numpy(dtype=float))
+    return rate_curve(leading, n_events, thresholds, confidence)
+
+
+# Efficiency at each threshold: fraction of the gen muons (data_denominator, gen pT >= gen_pt_min)
+# whose matched candidate (data_numerator) has pT >= threshold
+def efficiency_at_thresholds(data_numerator, data_denominator, thresholds, gen_pt_min=0, confidence=0.683):
+    thresholds = np.asarray(thresholds, dtype=float)
+    selected = data_denominator['theColl._pt'].to_numpy(dtype=float) >= gen_pt_min
+    matched = data_numerator[data_numerator['theColl._pt'] >= gen_pt_min]
+    pt = matched['theL1Obj.pt'].to_numpy(dtype=float)
+    weights = rw.row_weights(data_denominator)
+    if weights is not None:
+        n_gen, n_gen_squares = weights[selected].sum(), (weights[selected]**2).sum()
+    else:
+        n_gen = n_gen_squares = int(np.sum(selected))
+    # weighted and unweighted numerators and denominators can be mixed (weight 1 for unweighted rows)
+    matched_weights = rw.row_weights(matched)
+    matched_weights = None if matched_weights is None else matched_weights[np.isfinite(pt)]
+    counts = np.histogram(pt[np.isfinite(pt)], bins=np.append(thresholds, np.inf), weights=matched_weights)[0]
+    passing = np.minimum(np.cumsum(counts[::-1])[::-1], n_gen)
+    eff = passing / n_gen if n_gen > 0 else np.zeros(len(passing))
+    k, n = unc.effective_counts(passing, np.full(len(passing), n_gen), np.full(len(passing), n_gen_squares))
+    lower, upper = unc.clopper_pearson(k, n, confidence)
+    return eff, unc.interval_errors(eff, lower, upper)
@@ -0,0 +1,74 @@
+import numpy as np
+
+import uncertainties as unc
+
+# Reweighting of one sample to the gen spectrum of another (e.g. displaced -> SingleMu in gen pT,
+# or in gen pT and eta). A table holds the ratio target / source of the normalized gen histograms
+# in 1 or 2 (or more) columns; the weight of every row of any table with these gen columns
+# (gen, matched, cut) is then one bin lookup: the bin indices of the columns are combined into a
+# flat index and the weights are gathered from the flattened ratio in one step.
+# The weights are kept in the WEIGHT_COLUMN of the tables, the histograms, efficiencies and means
+# of plotting_functions use it when it is there.
+
+# List of available functions:
+# - row_weights
+# - ratio_table
+# - event_weights
+# - add_weights
+# - save_table
+# - load_table
+
+WEIGHT_COLUMN = 'weight'
+
+
+# Weights of the rows of a table, None when it is not weighted
+def row_weights(data):
+    return data[WEIGHT_COLUMN].to_numpy(dtype=float) if WEIGHT_COLUMN in data.columns else None
+
+
+# Ratio of the normalized target / source histograms in the columns (one bins array per column),
+# weighted tables are filled with their weights, bins without source entries get 0
+def ratio_table(source, target, columns, bins):
+    edges = [np.asarray(edges, dtype=float) for edges in bins]
+    source_counts = np.histogramdd(source[columns].to_numpy(dtype=float), bins=edges, weights=row_weights(source))[0]
+    target_counts = np.histogramdd(target[columns].to_numpy(dtype=float), bins=edges, weights=row_weights(target))[0]
+    source_density = source_counts / max(source_counts.sum(), 1e-300)
+    target_density = target_counts / max(target_counts.sum(), 1e-300)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(source_density > 0, target_density / source_density, 0.0)
+    return {'columns': list(columns), 'edges': edges, 'ratio': ratio}
+
+
+# Weight of every row of data, rows outside the table bins (or with NaN) get outside
+def event_weights(table, data, outside=1.0):
+    flat = np.zeros(len(data), dtype=np.int64)
+    inside = np.ones(len(data), dtype=bool)
+    for column, edges in zip(table['columns'], table['edges']):
+        index = unc.bin_indices(data[column].to_numpy(dtype=float), edges)
+        inside &= index >= 0
+        flat = flat * (len(edges) - 1) + index
+    weights = np.full(len(data), outside, dtype=float)
+    weights[inside] = table['ratio'].ravel()[flat[inside]]
+    return weights
+
+
+# Copy of data with the weights of the table (multiplied with the weights it already has)
+def add_weights(data, table, outside=1.0):
+    weights = event_weights(table, data, outside)
+    data = data.copy()
+    if WEIGHT_COLUMN in data.columns:
+        weights = weights * data[WEIGHT_COLUMN].to_numpy()
+    data[WEIGHT_COLUMN] = weights
+    return data
+
+
+def save_table(filename, table):
+    np.savez_compressed(filename, columns=np.array(table['columns']), ratio=table['ratio'],
+                        **{f'edges_{i}': edges for i, edges in enumerate(table['edges'])})
+    return filename
+
+
+def load_table(filename):
+    with np.load(filename) as stored:
+        columns = [str(column) for column in stored['columns']]
+        return {'columns': columns, 'edges': [stored[f'edges_{i}'] for i in range(len(columns))], 'ratio': stored['ratio']}
@@ -1,78 +1,211 @@
 import numpy as np
-import matplotlib.pyplot as plt
-import pandas as pd
-import uproot as upr
-import awkward as ak
-from matplotlib.colors import LogNorm
 import shutil
 import os
-from numba import jit
 import warnings
-import cmath
+import instrumentation as ins
+import prefetch
+import reweighting as rw
+# uproot, awkward and pandas are imported inside the functions which need them,
+# so that importing this module stays fast
+
 #there is a future warning that is not important for now. 
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
 # list of available functions:
+# - set_reading
 # - load_data
+# - count_events
 # - refresh_fig_dir
 # - calculate_dxy_Lxy_Lz_for_gen
 # - match_gen_muons
+# - apply_veto
 
 unused_columns_gen = ['theColl._mass', 'theColl._id', 'theColl._mid','theColl._beta']
 unused_columns_reco= ['theL1Obj.fUniqueID', 'theL1Obj.fBits', 'theL1Obj.z0', 'theL1Obj.d0', 'theL1Obj.disc','theL1Obj.hits','theL1Obj.hwBeta']
 
+# Veto thresholds: (upper edge of the L1 pT bin, max. normalized common stub count)
+# L1 pT <= 2 GeV never passes, above the last edge the last threshold is used
+veto_pt_edges = [2, 4, 6, 8, 10]
+veto_stub_count_norm_max = [0.06, 0.27, 0.6, 0.74, 0.95]
+
+
+
+# Chunked reading: the tree is read in chunks of chunk_size entries,
+# the next chunks are read and decompressed in a background thread (up to prefetch_depth
+# chunks and prefetch_max_mb ahead) while the current one is flattened and converted.
+# chunk_size=None reads the whole tree at once. See set_reading.
+# Sampling (fraction < 1) reads a reproducible fraction of the events, the same ones from every
+# branch (the entry numbers are kept, so matching stays valid):
+# - 'stride': SAMPLING_BLOCKS evenly spaced blocks of entries, only the baskets (clusters) holding
+#             them are read from the file, each once
+# - 'hash':   the entries whose hashed entry number falls below the fraction (spread over the
+#             whole file, but every entry is read)
+# The tables then get a weight column of (all entries / kept entries), so counts are scaled to
+# the full sample, and count_events gives the number of kept events (for rates).
+reading = {'chunk_size': 500_000, 'prefetch_depth': 2, 'prefetch_max_mb': 2048, 'fraction': 1.0, 'sampling': 'stride'}
+sampling_modes = ['stride', 'hash']
+SAMPLING_BLOCKS = 100
+
+
+def set_reading(**settings):
+    for key in settings:
+        if key not in reading:
+            raise ValueError(f"Unknown reading setting '{key}', available: {sorted(reading)}")
+    if settings.get('sampling', reading['sampling']) not in sampling_modes:
+        raise ValueError(f"Unknown sampling '{settings['sampling']}', available: {sampling_modes}")
+    if not 0 < settings.get('fraction', reading['fraction']) <= 1:
+        raise ValueError(f"The sampling fraction must be in (0, 1], got {settings['fraction']}")
+    reading.update(settings)
+
+
+# Entry ranges of the tree which are read, see reading
+def _sampled_ranges(n_entries):
+    fraction = reading['fraction']
+    if fraction >= 1 or reading['sampling'] == 'hash':
+        return [(0, n_entries)]
+    block = max(1, round(n_entries * fraction / SAMPLING_BLOCKS))
+    starts = np.arange(0, n_entries, block / fraction).astype(np.int64)
+    return [(start, min(start + block, n_entries)) for start in starts.tolist()]
+
+
+# Entry spans read for the ranges: every range widened to the cluster boundaries (offsets, the common
+# entry offsets of the branches) and overlapping spans merged, so that no basket is decompressed twice
+def _read_spans(ranges, offsets):
+    offsets = np.asarray(offsets, dtype=np.int64)
+    spans = []
+    for start, stop in ranges:
+        start = int(offsets[max(np.searchsorted(offsets, start, side='right') - 1, 0)])
+        stop = int(offsets[min(np.searchsorted(offsets, stop, side='left'), len(offsets) - 1)])
+        if spans and start <= spans[-1][1]:
+            spans[-1] = (spans[-1][0], max(spans[-1][1], stop))
+        else:
+            spans.append((start, max(stop, start)))
+    return spans
+
+
+# Which of the entries are kept by the sampling (None: all of them): those inside the ranges
+# for 'stride', those whose hash falls below the fraction for 'hash'
+def _sampled_mask(entries, ranges):
+    if reading['fraction'] >= 1:
+        return None
+    if reading['sampling'] == 'stride':
+        starts = np.array([start for start, _ in ranges], dtype=np.int64)
+        stops = np.array([stop for _, stop in ranges], dtype=np.int64)
+        index = np.searchsorted(starts, entries, side='right') - 1
+        return (index >= 0) & (entries < stops[np.maximum(index, 0)])
+    # splitmix64 of the entry number, the top 53 bits as a uniform number in [0, 1)
+    z = entries.astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    z = z ^ (z >> np.uint64(31))
+    return (z >> np.uint64(11)) * 2.0**-53 < reading['fraction']
+
+
+# Number of entries of the tree and its chunks (with the entry numbers of their events) read in the background
+def _read_chunks(filename, path, tree, branch, sample):
+    import uproot as upr
 
-
-def load_data(filename, path, tree, branch):
     # Open the ROOT file
     file = upr.open(path + filename)
     # Access the specified tree
     tree = file[tree]
-    
-    # Display available branches (commented out)
-    # print("Available branches:", tree.keys())
-    
-    # Extract the specified branch as an awkward array
-    arrays = tree.arrays(filter_name=branch)
-    # Convert the awkward array to a pandas DataFrame
-    data = ak.to_dataframe(arrays)
-    # Add 'entry' and 'subentry' columns based on the index levels - useful when .root file contains nested lists
-    data['entry'] = data.index.get_level_values(0)   
-    data['subentry'] = data.index.get_level_values(1) 
-    # Reset the index of the DataFrame
-    data = data.reset_index(drop=True)
-    # Explode the DataFrame to flatten nested lists
-    data = data.explode(list(data.columns))  
-    # Drop rows with any NaN values
-    data = data.dropna()
+    n_entries = tree.num_entries
+    compressed_bytes = sum(tree[key].compressed_bytes for key in tree.keys(filter_name=branch))
+    step = reading['chunk_size'] or max(n_entries, 1)
+    ranges = _sampled_ranges(n_entries)
+    spans = _read_spans(ranges, tree.common_entry_offsets(filter_name=branch)) if len(ranges) > 1 else ranges
+
+    def chunks():
+        for start, stop in spans:
+            for entry_start in range(start, max(stop, start + 1), step):
+                entry_stop = min(entry_start + step, stop)
+                with ins.stage('read', sample) as record:
+                    # Extract the specified branch as an awkward array
+                    arrays = tree.arrays(filter_name=branch, entry_start=entry_start, entry_stop=entry_stop)
+                    record['bytes_read'] = round(compressed_bytes * len(arrays) / max(n_entries, 1))
+                    entries = np.arange(entry_start, entry_start + len(arrays))
+                    kept = _sampled_mask(entries, ranges)
+                    if kept is not None:
+                        arrays, entries = arrays[kept], entries[kept]
+                    record['rows_out'] = len(arrays)
+                yield arrays, entries
+        file.close()
+
+    max_bytes = reading['prefetch_max_mb'] * 2**20 if reading['prefetch_max_mb'] else None
+    return n_entries, prefetch.prefetch(chunks(), depth=reading['prefetch_depth'], max_bytes=max_bytes, nbytes=lambda chunk: chunk[0].nbytes)
+
+
+# Flatten one chunk and convert it like a whole file (entries: the entry numbers of its events)
+def _process_chunk(arrays, entries, branch, sample):
+    import awkward as ak
+
+    with ins.stage('flatten', sample, rows_in=len(arrays)) as record:
+        # Convert the awkward array to a pandas DataFrame
+        data = ak.to_dataframe(arrays)
+        # Keep only the leaf names as column names (theColl._pt, theL1Obj.pt, ...)
+        data.columns = [column.split('/')[-1] for column in data.columns]
+        # Add 'entry' and 'subentry' columns based on the index levels - useful when .root file contains nested lists
+        data['entry'] = entries[data.index.get_level_values(0)]
+        data['subentry'] = data.index.get_level_values(1) 
+        # Reset the index of the DataFrame
+        data = data.reset_index(drop=True)
+        # Explode the DataFrame to flatten nested lists
+        data = data.explode(list(data.columns))  
+        # Drop rows with any NaN values
+        data = data.dropna()
+        record['rows_out'] = len(data)
     #remove unused columns
 
     if branch == 'genColl/theColl/theColl._*':
-        data = data.drop(columns=unused_columns_gen)
-        # Filter data to include only rows where 'subentry' (if in subentry 0 and 1 are duplicates) equals 0
-        data = data[data['subentry'] == 0]
+        with ins.stage('convert', sample, rows_in=len(data)) as record:
+            data = data.drop(columns=unused_columns_gen)
+            # Filter data to include only rows where 'subentry' (if in subentry 0 and 1 are duplicates) equals 0
+            data = data[data['subentry'] == 0]
+            record['rows_out'] = len(data)
         
-        # Calculate additional variables (dxy, Lxy, Lz) for gen-level data
-        data = calculate_dxy_Lxy_Lz_for_gen(data)
-        # Adjust the 'phi' value by adding \pi to shift the range to (0,2\pi)
-        data.loc[:, 'theColl._phi'] = data['theColl._phi'] + np.pi
-        data=data[abs(data['theColl._eta'])<2.5]
+        with ins.stage('derive', sample, rows_in=len(data)) as record:
+            # Calculate additional variables (dxy, Lxy, Lz) for gen-level data
+            data = calculate_dxy_Lxy_Lz_for_gen(data)
+            record['rows_out'] = len(data)
+
+        with ins.stage('convert', sample, rows_in=len(data)) as record:
+            # Adjust the 'phi' value by adding \pi to shift the range to (0,2\pi)
+            data.loc[:, 'theColl._phi'] = data['theColl._phi'] + np.pi
+            data=data[abs(data['theColl._eta'])<2.5]
+            record['rows_out'] = len(data)
     elif branch == 'l1ObjColl/theL1Obj/theL1Obj.*' in branch:
-        
-        data = data.drop(columns=unused_columns_reco)
+        with ins.stage('convert', sample, rows_in=len(data)) as record:
+            data = data.drop(columns=unused_columns_reco)
 
-        # Apply transformations to normal eta and phi for theL1Obj.type == 10
-        data_omtf = data[data['theL1Obj.type'] == 10].copy()
+            # Apply transformations to normal eta and phi for theL1Obj.type == 10
+            data_omtf = data[data['theL1Obj.type'] == 10].copy()
 
-        data_omtf.loc[:, 'theL1Obj.eta'] = data_omtf['theL1Obj.eta'] / 240 * 2.61
-        data_omtf.loc[:, 'theL1Obj.phi'] = ((15 + data_omtf['theL1Obj.iProcessor'] * 60) / 360 + data_omtf['theL1Obj.phi'] / 576) * 2 * np.pi
-        data_omtf.loc[:, 'theL1Obj.pt'] = (data_omtf['theL1Obj.pt'] - 1) / 2
-        data.update(data_omtf)
+            data_omtf.loc[:, 'theL1Obj.eta'] = data_omtf['theL1Obj.eta'] / 240 * 2.61
+            data_omtf.loc[:, 'theL1Obj.phi'] = ((15 + data_omtf['theL1Obj.iProcessor'] * 60) / 360 + data_omtf['theL1Obj.phi'] / 576) * 2 * np.pi
+            data_omtf.loc[:, 'theL1Obj.pt'] = (data_omtf['theL1Obj.pt'] - 1) / 2
+            data.update(data_omtf)
 
-        data_SA = data[data['theL1Obj.type'] == 16].copy()
-        data_SA['theL1Obj.phi'] = data_SA['theL1Obj.phi'] + np.pi
-        data.update(data_SA)
-        
+            data_SA = data[data['theL1Obj.type'] == 16].copy()
+            data_SA['theL1Obj.phi'] = data_SA['theL1Obj.phi'] + np.pi
+            data.update(data_SA)
+            record['rows_out'] = len(data)
+    return data
+
+
+def load_data(filename, path, tree, branch):
+    import pandas as pd
+
+    sample = f"{filename}:{branch.split('/')[0]}"
+    n_entries, chunks = _read_chunks(filename, path, tree, branch, sample)
+    kept_entries = 0
+    tables = []
+    for arrays, entries in chunks:
+        kept_entries += len(entries)
+        tables.append(_process_chunk(arrays, entries, branch, sample))
+    data = pd.concat(tables, ignore_index=True) if len(tables) > 1 else tables[0].reset_index(drop=True)
+    if reading['fraction'] < 1:
+        # Scale the counts to all the entries of the tree
+        data[rw.WEIGHT_COLUMN] = n_entries / max(kept_entries, 1)
 
     # Print information about the loaded data
     print(f'Data loaded: {filename}, tree:  {branch}')
@@ -81,6 +214,18 @@ def load_data(filename, path, tree, branch):
     return data
 
 
+# Number of events in the tree (trigger rates are fractions of all events, also those without candidates),
+# with sampling the number of events kept
+def count_events(filename, path, tree):
+    import uproot as upr
+    with upr.open(path + filename) as file:
+        n_entries = file[tree].num_entries
+    if reading['fraction'] >= 1:
+        return n_entries
+    if reading['sampling'] == 'hash':
+        return int(_sampled_mask(np.arange(n_entries), [(0, n_entries)]).sum())
+    return sum(stop - start for start, stop in _sampled_ranges(n_entries))
+
 
 def refresh_fig_dir(fig_path, refresh=False):
     if refresh:
@@ -93,6 +238,7 @@ def refresh_fig_dir(fig_path, refresh=False):
         os.makedirs(fig_path, exist_ok=True)
         print('Directory refreshed')
     else: 
+        os.makedirs(fig_path, exist_ok=True)
         print('Directory not refreshed')
 
 
@@ -110,36 +256,44 @@ def calculate_dxy_Lxy_Lz_for_gen(data):
 
 
 def match_gen_muons(data_reco, data_gen):
-    data_reco = data_reco.copy()
-    data_gen = data_gen.copy()
-
-    # Merge reco and gen data on 'entry' column
-    merged_df = pd.merge(data_gen, data_reco, on='entry', how='left')
-
-    # Calculate deltaEta between gen and reco muons
-    #deltaEta =   -myGenObj.eta()*aCand.etaValue();
-    merged_df['deltaEta'] = (-1)*merged_df['theColl._eta']*merged_df['theL1Obj.eta']
-    # merged_df['deltaEta'] = abs(merged_df['theColl._eta'] - merged_df['theL1Obj.eta'])
-    # print(merged_df)
-
-    # Find the closest match for each entry based on minimum deltaEta
-    merged_df = merged_df.loc[
-        merged_df.groupby('entry')['deltaEta'].idxmin().dropna().astype(int)
-    ].combine_first(merged_df[merged_df['deltaEta'].isna()])
+    import pandas as pd
+
+    with ins.stage('match', rows_in=len(data_reco) + len(data_gen)) as record:
+        # the matched rows keep the weights of the gen muons
+        data_reco = data_reco.drop(columns=rw.WEIGHT_COLUMN, errors='ignore')
+        data_gen = data_gen.copy()
+
+        # Merge reco and gen data on 'entry' column
+        merged_df = pd.merge(data_gen, data_reco, on='entry', how='left')
+
+        # Calculate deltaEta between gen and reco muons
+        #deltaEta =   -myGenObj.eta()*aCand.etaValue();
+        merged_df['deltaEta'] = (-1)*merged_df['theColl._eta']*merged_df['theL1Obj.eta']
+        # merged_df['deltaEta'] = abs(merged_df['theColl._eta'] - merged_df['theL1Obj.eta'])
+        # print(merged_df)
+
+        # Find the closest match for each entry based on minimum deltaEta
+        merged_df = merged_df.loc[
+            merged_df.groupby('entry')['deltaEta'].idxmin().dropna().astype(int)
+        ].combine_first(merged_df[merged_df['deltaEta'].isna()])
+        record['rows_out'] = len(merged_df)
     
 
     return merged_df
 
 
 
+# Keep only the candidates passing the stub-count veto (vectorized version of the
+# per-row pass_veto check, NaN rows from unmatched gen muons never pass)
+def apply_veto(data):
+    pt = data['theL1Obj.pt'].to_numpy(dtype=float)
+    stub_count_norm = (data['theL1Obj.commonStubCount'] / data['theL1Obj.totalStubCount']).to_numpy(dtype=float)
 
+    conditions = [pt <= veto_pt_edges[0]]
+    choices = [False]
+    for low, high, threshold in zip(veto_pt_edges[:-1], veto_pt_edges[1:], veto_stub_count_norm_max[:-1]):
+        conditions.append((pt > low) & (pt <= high))
+        choices.append(stub_count_norm < threshold)
+    passed = np.select(conditions, choices, default=stub_count_norm < veto_stub_count_norm_max[-1])
 
-
-
-
-
-
-
-
-
-
+    return data[passed]
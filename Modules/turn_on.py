@@ -0,0 +1,154 @@
+import csv
+import numpy as np
+
+# Turn-on curves eff(x) = plateau * F((x - x50) / width) fitted to binned efficiencies:
+#   erf:     F = (1 + erf(z / sqrt(2))) / 2   (width = resolution at the threshold)
+#   sigmoid: F = 1 / (1 + exp(-z))
+# All the curves of a call are fitted together: one weighted Levenberg-Marquardt loop where the
+# residuals and the analytic Jacobians of every curve are arrays (n_curves x n_bins (x 3)) and
+# the 3x3 steps of all curves are solved at once, so hundreds of fits take one vectorized loop.
+# Bins with no error (empty denominator) are left out, the (down, up) errors are averaged.
+
+# List of available functions:
+# - turn_on_curve
+# - initial_parameters
+# - fit_turn_ons
+# - fit_rows
+# - write_fit_table
+# - read_fit_tables
+
+models = ['erf', 'sigmoid']
+parameters = ['plateau', 'x50', 'width']
+
+
+# Value and Jacobian (d/d plateau, x50, width) of the model, params has shape (n_curves, 3)
+def _model_and_jacobian(model, x, params):
+    from scipy.special import erf, expit
+    plateau, x50, width = (params[:, i, None] for i in range(3))
+    z = (x - x50) / width
+    if model == 'erf':
+        shape = 0.5 * (1 + erf(z / np.sqrt(2)))
+        slope = np.exp(-0.5 * z**2) / np.sqrt(2 * np.pi)
+    else:
+        shape = expit(z)
+        slope = shape * (1 - shape)
+    d_x50 = -plateau * slope / width
+    return plateau * shape, np.stack([shape, d_x50, d_x50 * z], axis=-1)
+
+
+def turn_on_curve(x, params, model='erf'):
+    if model not in models:
+        raise ValueError(f"Unknown turn-on model '{model}', available: {models}")
+    return _model_and_jacobian(model, np.asarray(x, dtype=float), np.atleast_2d(params))[0]
+
+
+# Start values: plateau from the highest bins, x50 where the curve first crosses half of it
+def initial_parameters(x, eff, valid):
+    masked = np.where(valid, eff, np.nan)
+    with np.errstate(invalid='ignore'):
+        plateau = np.nan_to_num(np.nanpercentile(np.where(valid.any(axis=1)[:, None], masked, 0), 90, axis=1), nan=1.0)
+    above = valid & (eff >= plateau[:, None] / 2)
+    x50 = np.where(above.any(axis=1), x[np.argmax(above, axis=1)], np.median(x))
+    width = np.maximum(0.1 * np.abs(x50), np.mean(np.diff(x)))
+    return np.stack([np.clip(plateau, 0.05, 1), x50, width], axis=1)
+
+
+def _chi2(model, x, eff, weights, params):
+    return np.sum(((eff - _model_and_jacobian(model, x, params)[0]) * weights)**2, axis=1)
+
+
+# Keep the parameters physical: plateau in [0, 1.5], x50 at most one x range below the first bin
+# (flat curves), width between a small fraction of the x range and the x range
+def _constrain(params, x):
+    params = params.copy()
+    x_range = x[-1] - x[0]
+    params[:, 0] = np.clip(params[:, 0], 0, 1.5)
+    params[:, 1] = np.clip(params[:, 1], x[0] - x_range, x[-1])
+    params[:, 2] = np.clip(np.abs(params[:, 2]), 1e-3 * x_range, x_range)
+    return params
+
+
+# Fit every row of eff (n_curves x n_bins) at the bin centers x; eff_err is (n_curves x n_bins)
+# or (n_curves x 2 x n_bins) with (down, up) errors. Returns arrays over the curves.
+def fit_turn_ons(x, eff, eff_err, model='erf', max_iterations=200, tolerance=1e-7):
+    if model not in models:
+        raise ValueError(f"Unknown turn-on model '{model}', available: {models}")
+    x = np.asarray(x, dtype=float)
+    eff = np.atleast_2d(np.asarray(eff, dtype=float))
+    eff_err = np.asarray(eff_err, dtype=float)
+    sigma = eff_err.mean(axis=-2) if eff_err.ndim == 3 else np.atleast_2d(eff_err)
+    valid = (sigma > 0) & np.isfinite(eff)
+    weights = np.where(valid, 1 / np.where(valid, sigma, 1), 0)
+    eff = np.where(valid, eff, 0)
+    ndf = valid.sum(axis=1) - 3
+
+    params = _constrain(initial_parameters(x, eff, valid), x)
+    chi2 = _chi2(model, x, eff, weights, params)
+    damping = np.full(len(eff), 1e-3)
+    done = ndf <= 0
+    converged = np.zeros(len(eff), dtype=bool)
+    eye = np.eye(3)
+    for _ in range(max_iterations):
+        values, jacobian = _model_and_jacobian(model, x, params)
+        jacobian = jacobian * weights[..., None]
+        residuals = (eff - values) * weights
+        curvature = np.einsum('nbi,nbj->nij', jacobian, jacobian)
+        gradient = np.einsum('nbi,nb->ni', jacobian, residuals)
+        damped = curvature + (damping[:, None, None] * np.diagonal(curvature, axis1=1, axis2=2)[:, :, None] + 1e-12) * eye
+        step = np.linalg.solve(damped, gradient[..., None])[..., 0]
+
+        trial = _constrain(params + step, x)
+        trial_chi2 = _chi2(model, x, eff, weights, trial)
+        better = (trial_chi2 < chi2) & ~done
+        small = better & (chi2 - trial_chi2 <= tolerance * np.maximum(chi2, 1))
+        params = np.where(better[:, None], trial, params)
+        chi2 = np.where(better, trial_chi2, chi2)
+        damping = np.where(better, damping / 10, damping * 10)
+
+        stuck = ~done & (damping > 1e8)
+        converged |= small | stuck
+        done |= small | stuck
+        if done.all():
+            break
+
+    jacobian = _model_and_jacobian(model, x, params)[1] * weights[..., None]
+    curvature = np.einsum('nbi,nbj->nij', jacobian, jacobian) + 1e-12 * eye
+    errors = np.sqrt(np.abs(np.diagonal(np.linalg.inv(curvature), axis1=1, axis2=2)))
+    # A fit which stopped (chi2 no longer improving, or no step improving it) has converged only when
+    # its parameters are determined: finite errors within the allowed parameter ranges
+    x_range = x[-1] - x[0]
+    converged &= np.all(np.isfinite(errors) & (errors <= [1.5, 2 * x_range, x_range]), axis=1)
+    failed = ndf <= 0
+    params[failed], errors[failed], chi2[failed] = np.nan, np.nan, np.nan
+    return {'params': params, 'errors': errors, 'chi2': chi2, 'ndf': ndf, 'converged': converged & ~failed}
+
+
+# Rows of the summary table, one per fitted curve
+def fit_rows(fits, labels, model, plot=''):
+    rows = []
+    for i, label in enumerate(labels):
+        row = {'plot': plot, 'curve': label, 'model': model}
+        for j, name in enumerate(parameters):
+            row[name] = fits['params'][i][j]
+            row[f'{name}_err'] = fits['errors'][i][j]
+        row.update(chi2=fits['chi2'][i], ndf=int(fits['ndf'][i]), converged=bool(fits['converged'][i]))
+        rows.append(row)
+    return rows
+
+
+def write_fit_table(filename, rows):
+    columns = ['plot', 'curve', 'model'] + [f'{name}{suffix}' for name in parameters for suffix in ('', '_err')] + ['chi2', 'ndf', 'converged']
+    with open(filename, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    return filename
+
+
+# Rows of several fit tables, e.g. to merge the tables of all the plots of a directory
+def read_fit_tables(filenames):
+    rows = []
+    for filename in filenames:
+        with open(filename, newline='') as f:
+            rows += list(csv.DictReader(f))
+    return rows
@@ -0,0 +1,183 @@
+import math
+import warnings
+import numpy as np
+from statistics import NormalDist
+
+# Uncertainties of efficiencies and binned means.
+# - Exact intervals for k passing out of n (Clopper-Pearson, Wilson), computed for all bins at once.
+# - Poisson bootstrap: every entry gets a Poisson(1) weight in each replica, the entries are binned
+#   once (bin_indices) and sorted by bin, and all the replicas are filled together into an
+#   (n_replicas x n_bins) matrix by one np.add.reduceat per chunk of entries. The Poisson(1)
+#   weights come from a 16-bit lookup table, much faster than rng.poisson.
+# Errors are returned as distances from the central value, shape (2, n_bins) = (down, up),
+# which plt.errorbar takes as yerr.
+
+# List of available functions:
+# - bin_indices
+# - clopper_pearson
+# - wilson
+# - interval_errors
+# - effective_counts
+# - efficiency_errors
+# - bootstrap_fill
+# - bootstrap_efficiency
+# - bootstrap_mean
+
+efficiency_methods = ['clopper_pearson', 'wilson', 'bootstrap', 'normal']
+
+# Entries per chunk of the bootstrap fill (the weight matrix is n_replicas x CHUNK_ENTRIES float32)
+CHUNK_ENTRIES = 100_000
+
+# Poisson(1) value of every 16-bit random integer (inverse CDF, the tail beyond 1e-5 is cut)
+_poisson_cdf = np.cumsum([math.exp(-1) / math.factorial(i) for i in range(12)])
+_poisson_table = np.searchsorted(_poisson_cdf, (np.arange(2**16) + 0.5) / 2**16).astype(np.float32)
+
+
+# Bin of every value (-1 outside the bins), right=False like np.histogram, right=True like pd.cut.
+# Uniform bins are found arithmetically (like np.histogram) and corrected at the edges,
+# so the result is the same as with searchsorted.
+def bin_indices(values, bins, right=False):
+    values = np.asarray(values, dtype=float)
+    bins = np.asarray(bins, dtype=float)
+    n_bins = len(bins) - 1
+    if n_bins > 1 and np.allclose(np.diff(bins), bins[1] - bins[0], rtol=1e-9, atol=0):
+        index = _uniform_bin_indices(values, bins, right)
+    elif right:
+        index = np.searchsorted(bins, values, side='left') - 1
+    else:
+        index = np.searchsorted(bins, values, side='right') - 1
+    if not right:
+        index[values == bins[-1]] = n_bins - 1
+    index[(index < 0) | (index >= n_bins) | np.isnan(values)] = -1
+    return index
+
+
+def _uniform_bin_indices(values, bins, right):
+    n_bins = len(bins) - 1
+    # first guess clipped to the bins (NaN lands in the last bin, it is masked afterwards)
+    index = (values - bins[0]) * (n_bins / (bins[-1] - bins[0]))
+    index = np.fmax(np.fmin(index, n_bins - 1), 0, out=index).astype(np.intp)
+    if right:
+        index -= values <= bins[index]
+        index += values > bins[index + 1]
+    else:
+        index -= values < bins[index]
+        index += values >= bins[index + 1]
+    return index
+
+
+def _z(confidence):
+    return NormalDist().inv_cdf(0.5 + confidence / 2)
+
+
+# Exact (Clopper-Pearson) interval of k passing out of n
+def clopper_pearson(k, n, confidence=0.683):
+    from scipy.special import betaincinv
+    k, n = np.asarray(k, dtype=float), np.asarray(n, dtype=float)
+    alpha = 1 - confidence
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lower = np.where(k > 0, betaincinv(np.maximum(k, 1), np.maximum(n - k + 1, 1), alpha / 2), 0.0)
+        upper = np.where(k < n, betaincinv(k + 1, np.maximum(n - k, 1), 1 - alpha / 2), 1.0)
+    return np.nan_to_num(lower, nan=0.0), np.nan_to_num(upper, nan=1.0)
+
+
+# Wilson score interval of k passing out of n
+def wilson(k, n, confidence=0.683):
+    k, n = np.asarray(k, dtype=float), np.asarray(n, dtype=float)
+    z = _z(confidence)
+    n_safe = np.where(n > 0, n, 1)
+    p = k / n_safe
+    center = (p + z**2 / (2 * n_safe)) / (1 + z**2 / n_safe)
+    half_width = z / (1 + z**2 / n_safe) * np.sqrt(p * (1 - p) / n_safe + z**2 / (4 * n_safe**2))
+    return np.clip(center - half_width, 0, 1), np.clip(center + half_width, 0, 1)
+
+
+# (down, up) error bars of a value inside [lower, upper]
+def interval_errors(value, lower, upper):
+    return np.array([np.maximum(value - lower, 0), np.maximum(upper - value, 0)])
+
+
+# Weighted passing / total counts as the unweighted counts with the same relative error:
+# n_eff = (sum w)^2 / sum w^2 and k_eff = eff * n_eff (the counts themselves when all weights are 1)
+def effective_counts(sum_w_passing, sum_w, sum_w2):
+    sum_w, sum_w2 = np.asarray(sum_w, dtype=float), np.asarray(sum_w2, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        n_eff = np.where(sum_w2 > 0, sum_w**2 / sum_w2, 0.0)
+        k_eff = np.where(sum_w > 0, np.asarray(sum_w_passing, dtype=float) / sum_w, 0.0) * n_eff
+    return k_eff, n_eff
+
+
+# Efficiency error bars of k passing out of n (zero in empty bins)
+def efficiency_errors(eff, k, n, method='clopper_pearson', confidence=0.683, n_replicas=200, seed=1):
+    if method not in efficiency_methods:
+        raise ValueError(f"Unknown efficiency error method '{method}', available: {efficiency_methods}")
+    n = np.asarray(n)
+    k = np.minimum(k, n)
+    if method == 'normal':
+        error = np.sqrt(eff * (1 - eff) / np.where(n > 0, n, 1))
+        return np.array([error, error])
+    if method == 'clopper_pearson':
+        lower, upper = clopper_pearson(k, n, confidence)
+    elif method == 'wilson':
+        lower, upper = wilson(k, n, confidence)
+    else:
+        lower, upper = bootstrap_efficiency(k, n, n_replicas, seed, confidence)
+    return np.where(n > 0, interval_errors(eff, lower, upper), 0.0)
+
+
+# Poisson bootstrap fill: sum of the weights (and of weights x values) per replica and bin.
+# bin_index comes from bin_indices, entries with -1 are skipped; weights are optional entry weights.
+def bootstrap_fill(bin_index, n_bins, values=None, weights=None, n_replicas=200, seed=1):
+    rng = np.random.default_rng(seed)
+    bin_index = np.asarray(bin_index)
+    order = np.argsort(bin_index, kind='stable')
+    order = order[bin_index[order] >= 0]
+    bin_index = bin_index[order]
+    values = None if values is None else np.asarray(values, dtype=np.float32)[order]
+    weights = None if weights is None else np.asarray(weights, dtype=np.float32)[order]
+
+    sum_w = np.zeros((n_replicas, n_bins))
+    sum_wy = np.zeros((n_replicas, n_bins)) if values is not None else None
+    for start in range(0, len(bin_index), CHUNK_ENTRIES):
+        stop = start + CHUNK_ENTRIES
+        filled, starts = np.unique(bin_index[start:stop], return_index=True)
+        replica_weights = _poisson_table[rng.integers(0, 2**16, (n_replicas, len(bin_index[start:stop])), dtype=np.uint16)]
+        if weights is not None:
+            replica_weights *= weights[start:stop]
+        sum_w[:, filled] += np.add.reduceat(replica_weights, starts, axis=1, dtype=np.float64)
+        if values is not None:
+            replica_weights *= values[start:stop]
+            sum_wy[:, filled] += np.add.reduceat(replica_weights, starts, axis=1, dtype=np.float64)
+
+    return sum_w if values is None else (sum_w, sum_wy)
+
+
+# Percentile interval of the efficiency from a Poisson bootstrap of the counts. For unweighted
+# entries the bootstrapped passing / failing counts of a bin are Poisson(k) / Poisson(n - k),
+# so the replicas are drawn directly from the counts.
+def bootstrap_efficiency(k, n, n_replicas=200, seed=1, confidence=0.683):
+    rng = np.random.default_rng(seed)
+    k, n = np.asarray(k, dtype=float), np.asarray(n, dtype=float)
+    passing = rng.poisson(k, (n_replicas,) + k.shape)
+    failing = rng.poisson(np.maximum(n - k, 0), (n_replicas,) + k.shape)
+    alpha = 1 - confidence
+    with np.errstate(divide='ignore', invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        replicas = passing / (passing + failing)
+        lower, upper = np.nanquantile(replicas, [alpha / 2, 1 - alpha / 2], axis=0)
+    return np.nan_to_num(lower, nan=0.0), np.nan_to_num(upper, nan=1.0)
+
+
+# Bootstrap standard error of the mean of values in the bins of x (NaN values are left out,
+# like in the pandas mean)
+def bootstrap_mean(x, values, bins, weights=None, n_replicas=200, seed=1):
+    index = bin_indices(x, bins, right=True)
+    values = np.asarray(values, dtype=float)
+    valid = ~np.isnan(values)
+    index, values = index[valid], values[valid]
+    weights = None if weights is None else np.asarray(weights)[valid]
+    sum_w, sum_wy = bootstrap_fill(index, len(bins) - 1, values, weights, n_replicas, seed)
+    with np.errstate(divide='ignore', invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        replicas = sum_wy / sum_w
+        return np.nanstd(replicas, axis=0, ddof=1)
@@ -0,0 +1,23 @@
+import os
+import sys
+import argparse
+
+# Add module paths
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "Modules"))
+import analysis_service as service
+import system_and_data as sd
+
+# Keep the samples of the campaigns loaded and answer requests, e.g.:
+#   python analysis_server.py campaigns/displaced.yaml --port 8765
+parser = argparse.ArgumentParser(description='Local analysis service keeping the campaign samples in memory')
+parser.add_argument('campaigns', nargs='+', help='campaign files (.yaml or .toml) with the samples and selections to keep')
+parser.add_argument('--host', default='127.0.0.1', help='interface to listen on')
+parser.add_argument('--port', type=int, default=8765, help='port to listen on')
+parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='number of parallel loaders')
+parser.add_argument('--fraction', type=float, default=1.0, help='load only this fraction of the events')
+parser.add_argument('--sampling', choices=sd.sampling_modes, default='stride', help='which events --fraction keeps')
+args = parser.parse_args()
+
+sd.set_reading(fraction=args.fraction, sampling=args.sampling)
+service.start_service(args.campaigns, jobs=args.jobs)
+service.serve(args.host, args.port)
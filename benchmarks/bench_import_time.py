@@ -0,0 +1,73 @@
+import os
+import sys
+import glob
+import time
+import argparse
+import subprocess
+
+# Startup-time guard: the light paths (module imports, --list-plots, --dry-run) must not
+# pull in matplotlib, mplhep, uproot, awkward or pandas (checked through sys.modules after each
+# of them). Every command is run a few times in a fresh interpreter, the best wall time is
+# compared with the budget, e.g.:
+#   python benchmarks/bench_import_time.py --budget 1.0
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES_DIR = os.path.join(ROOT_DIR, 'Modules')
+HEAVY_MODULES = ['matplotlib', 'mplhep', 'uproot', 'awkward', 'pandas', 'numba']
+
+
+# Python command which runs code (which may call sys.exit) and then fails when a heavy module was imported
+def check_heavy(code):
+    return [sys.executable, '-c',
+            "import sys\n"
+            "try:\n"
+            + ''.join(f'    {line}\n' for line in code.splitlines()) +
+            "except SystemExit as exit:\n"
+            "    if exit.code:\n"
+            "        raise\n"
+            f"heavy = [m for m in {HEAVY_MODULES!r} if m in sys.modules]\n"
+            "sys.exit('heavy modules imported: ' + ', '.join(heavy) if heavy else 0)\n"]
+
+
+# run_campaign.py with the given arguments, run as __main__ inside the heavy module check
+def run_campaign_command(*arguments):
+    script = os.path.join(ROOT_DIR, 'run_campaign.py')
+    return check_heavy(f"import runpy\nsys.argv = {[script, *arguments]!r}\nrunpy.run_path({script!r}, run_name='__main__')")
+
+
+def startup_commands():
+    campaign_files = sorted(glob.glob(os.path.join(ROOT_DIR, 'campaigns', '*.yaml')))
+    return {
+        'import Modules': check_heavy(f"sys.path.insert(0, {MODULES_DIR!r})\n"
+                                      "import system_and_data, plotting_functions, campaign, analysis_service"),
+        'run_campaign --list-plots': run_campaign_command(*campaign_files, '--list-plots'),
+        'run_campaign --dry-run': run_campaign_command(*campaign_files, '--dry-run'),
+    }
+
+
+# Best wall time of a command over a few runs
+def time_command(command, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run(command, capture_output=True, text=True)
+        times.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            raise RuntimeError(f"{' '.join(command)} failed:\n{result.stderr}")
+    return min(times)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the startup time of the light code paths')
+    parser.add_argument('--budget', type=float, default=1.0, help='allowed wall time per command [s]')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per command')
+    args = parser.parse_args()
+
+    over_budget = []
+    print(f"{'command':<30} {'best [s]':>10} {'budget [s]':>10}")
+    for name, command in startup_commands().items():
+        best = time_command(command, args.repeat)
+        print(f'{name:<30} {best:>10.3f} {args.budget:>10.3f}' + ('  OVER BUDGET' if best > args.budget else ''))
+        if best > args.budget:
+            over_budget.append(name)
+    sys.exit(1 if over_budget else 0)
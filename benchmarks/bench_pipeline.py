@@ -0,0 +1,160 @@
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import platform
+import subprocess
+import tracemalloc
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT_DIR, 'Modules'))
+sys.path.append(os.path.join(ROOT_DIR, 'benchmarks'))
+import system_and_data as sd
+import plotting_functions as pf
+import synthetic_tomtf
+
+# Benchmark of the pipeline stages on synthetic tOmtf files of several sizes:
+# every stage is timed (best of --repeat runs) and run once more under tracemalloc for
+# its peak memory. The results are written to benchmarks/results/<commit>.json and can
+# be compared with an earlier run to catch regressions, e.g.
+#   python benchmarks/bench_pipeline.py --sizes 1e4 1e5 1e6 --compare benchmarks/results/ead99c0.json
+
+TREE_NAME = 'tOmtf;3'
+BRANCH_L1 = 'l1ObjColl/theL1Obj/theL1Obj.*'
+BRANCH_GEN = 'genColl/theColl/theColl._*'
+PT_CUTS = [0, 5, 12, 20]
+PT_BINS = np.arange(0, 100, 1)
+
+
+def _load_gen(context):
+    return sd.load_data(context['filename'], context['path'], TREE_NAME, BRANCH_GEN)
+
+
+def _load_l1(context):
+    return sd.load_data(context['filename'], context['path'], TREE_NAME, BRANCH_L1)
+
+
+def _match_SA(context):
+    data = context['load_l1']
+    return sd.match_gen_muons(data[data['theL1Obj.type'] == 16], context['load_gen'])
+
+
+def _apply_veto(context):
+    return sd.apply_veto(context['match_SA'])
+
+
+def _calculate_mean(context):
+    return pf.calculate_mean(context['match_SA'].copy(), 'theColl._pt', 'theL1Obj.commonStubCount', PT_BINS)
+
+
+def _efficiency_ptCuts(context):
+    return pf.calculate_efficiency_ptCuts(context['match_SA'], context['load_gen'], 'theColl._pt', PT_BINS, PT_CUTS)
+
+
+def _efficiency_3_eta_ranges(context):
+    return [pf.calculate_efficiency_ptCuts(pf.select_eta_region(context['match_SA'], region), pf.select_eta_region(context['load_gen'], region),
+                                           'theColl._pt', PT_BINS, PT_CUTS) for region in pf.eta_regions]
+
+
+# Stages in the order they run, each one may use the results of the previous ones
+stages = [
+    ('load_gen', _load_gen),
+    ('load_l1', _load_l1),
+    ('match_SA', _match_SA),
+    ('apply_veto', _apply_veto),
+    ('calculate_mean', _calculate_mean),
+    ('efficiency_ptCuts', _efficiency_ptCuts),
+    ('efficiency_3_eta_ranges', _efficiency_3_eta_ranges),
+]
+
+
+def _rows(result):
+    return len(result) if hasattr(result, 'shape') and len(getattr(result, 'shape')) == 2 else None
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+# Time and memory-profile every stage on one file
+def benchmark_file(filename, repeat=3, memory=True):
+    context = {'path': os.path.dirname(filename) + '/', 'filename': os.path.basename(filename)}
+    results = {}
+    for name, stage in stages:
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = stage(context)
+            times.append(time.perf_counter() - start)
+        context[name] = result
+        results[name] = {'time_s': min(times), 'rows': _rows(result)}
+
+        if memory:
+            tracemalloc.start()
+            stage(context)
+            results[name]['peak_mb'] = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+    return results
+
+
+# Stages which got slower than tolerance x the baseline
+def compare_results(results, baseline, tolerance=1.25):
+    regressions = []
+    for size, stage_results in results['sizes'].items():
+        for name, result in stage_results.items():
+            reference = baseline['sizes'].get(size, {}).get(name)
+            if reference and reference['time_s'] > 0 and result['time_s'] > tolerance * reference['time_s']:
+                regressions.append((size, name, reference['time_s'], result['time_s']))
+    return regressions
+
+
+def print_table(results):
+    print(f"{'events':>10} {'stage':<26} {'time [s]':>10} {'peak [MB]':>10} {'rows':>10}")
+    for size, stage_results in results['sizes'].items():
+        for name, result in stage_results.items():
+            peak = f"{result['peak_mb']:.1f}" if 'peak_mb' in result else '-'
+            rows = result['rows'] if result['rows'] is not None else '-'
+            print(f"{size:>10} {name:<26} {result['time_s']:>10.4f} {peak:>10} {rows:>10}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline stages on synthetic tOmtf files')
+    parser.add_argument('--sizes', nargs='+', type=float, default=[1e4, 1e5, 1e6], help='numbers of events (up to 1e7)')
+    parser.add_argument('--data-dir', default=os.path.join('/tmp', 'tomtf_benchmark'), help='where the synthetic files are kept')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per stage (the best one is kept)')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc run of every stage')
+    parser.add_argument('--output', help='results file (default: benchmarks/results/<commit>.json)')
+    parser.add_argument('--compare', help='earlier results file to compare with')
+    parser.add_argument('--tolerance', type=float, default=1.25, help='allowed slow-down with respect to --compare')
+    args = parser.parse_args()
+
+    commit = _commit()
+    results = {'commit': commit, 'date': datetime.datetime.now().isoformat(timespec='seconds'),
+               'python': platform.python_version(), 'machine': platform.node(), 'sizes': {}}
+    for size in args.sizes:
+        n_events = int(size)
+        # the basket size is in the name, files written with another layout are not reused
+        filename = os.path.join(args.data_dir, f'synthetic_{n_events}_baskets{synthetic_tomtf.BASKET_SIZE}.root')
+        if not os.path.exists(filename):
+            synthetic_tomtf.write_synthetic_file(filename, n_events)
+        results['sizes'][str(n_events)] = benchmark_file(filename, args.repeat, memory=not args.no_memory)
+
+    print_table(results)
+    output = args.output or os.path.join(ROOT_DIR, 'benchmarks', 'results', f'{commit}.json')
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=1)
+    print(f'Results written: {output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare_results(results, json.load(f), args.tolerance)
+        for size, name, before, after in regressions:
+            print(f'REGRESSION {name} at {size} events: {before:.4f} s -> {after:.4f} s')
+        sys.exit(1 if regressions else 0)
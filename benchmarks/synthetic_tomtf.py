@@ -0,0 +1,122 @@
+import os
+import argparse
+import numpy as np
+
+# Synthetic ROOT files with the tOmtf layout read by system_and_data.load_data:
+# - tree tOmtf, cycle 3 (cycles 1 and 2 are small placeholders, like in the real files)
+# - genColl/theColl/theColl._* : jagged, two identical gen muons per event (subentry 0 and 1)
+# - l1ObjColl/theL1Obj/theL1Obj.* : jagged, a Poisson number of candidates per event of
+#   type 10 (OMTF, hardware units), 15 (TK) and 16 (SA)
+# e.g. python benchmarks/synthetic_tomtf.py /tmp/synthetic_1e5.root --events 100000
+
+TREE_NAME = 'tOmtf'
+GEN_PREFIX = 'genColl/theColl/theColl.'
+L1_PREFIX = 'l1ObjColl/theL1Obj/theL1Obj.'
+
+gen_leaves = ['_pt', '_eta', '_phi', '_mass', '_id', '_mid', '_beta', '_vx', '_vy', '_vz', '_charge']
+l1_leaves = ['fUniqueID', 'fBits', 'pt', 'eta', 'phi', 'charge', 'type', 'iProcessor', 'z0', 'd0', 'disc', 'hits',
+             'hwBeta', 'commonStubCount', 'totalStubCount', 'commonStubQuality', 'totalStubQuality']
+int_leaves = ['_id', '_mid', '_charge', 'fUniqueID', 'fBits', 'charge', 'type', 'iProcessor', 'hits', 'hwBeta',
+              'commonStubCount', 'totalStubCount', 'commonStubQuality', 'totalStubQuality']
+
+
+def _branch_types():
+    types = {}
+    for prefix, leaves in ((GEN_PREFIX, gen_leaves), (L1_PREFIX, l1_leaves)):
+        for leaf in leaves:
+            types[prefix + leaf] = 'var * int32' if leaf in int_leaves else 'var * float64'
+    return types
+
+
+# Events per basket of the written files
+BASKET_SIZE = 10_000
+
+
+# One chunk of events as jagged arrays {branch: awkward array}
+def make_chunk(n_events, rng, candidates_per_event=3.0, displacement=0.0, types=(10, 15, 16)):
+    import awkward as ak
+
+    # Gen muons, the second one of every event is a copy of the first
+    pt = np.exp(rng.uniform(np.log(1.0), np.log(200.0), n_events))
+    eta = rng.uniform(-2.5, 2.5, n_events)
+    phi = rng.uniform(-np.pi, np.pi, n_events)
+    charge = rng.choice([-1, 1], n_events)
+    if displacement > 0:
+        lxy = rng.exponential(displacement, n_events)
+        vertex_phi = rng.uniform(-np.pi, np.pi, n_events)
+        vx, vy = lxy * np.cos(vertex_phi), lxy * np.sin(vertex_phi)
+        vz = rng.normal(0, displacement, n_events)
+    else:
+        vx, vy, vz = rng.normal(0, 0.001, n_events), rng.normal(0, 0.001, n_events), rng.normal(0, 3.5, n_events)
+    gen = {'_pt': pt, '_eta': eta, '_phi': phi, '_mass': np.full(n_events, 0.10566), '_id': -13 * charge,
+           '_mid': np.zeros(n_events, dtype=np.int32), '_beta': np.ones(n_events), '_vx': vx, '_vy': vy, '_vz': vz,
+           '_charge': charge}
+    gen_counts = np.full(n_events, 2)
+
+    # L1 candidates, correlated with the gen muon of their event
+    l1_counts = rng.poisson(candidates_per_event, n_events)
+    n_candidates = l1_counts.sum()
+    event = np.repeat(np.arange(n_events), l1_counts)
+    candidate_type = rng.choice(types, n_candidates)
+    candidate_pt = pt[event] * rng.lognormal(0.0, 0.3, n_candidates)
+    candidate_eta = eta[event] + rng.normal(0, 0.05, n_candidates)
+    candidate_phi = np.mod(phi[event] + rng.normal(0, 0.05, n_candidates) + np.pi, 2 * np.pi) - np.pi
+    processor = rng.integers(0, 6, n_candidates)
+    total_stub_count = rng.integers(1, 9, n_candidates)
+    total_stub_quality = rng.integers(1, 30, n_candidates)
+
+    omtf = candidate_type == 10
+    candidate_pt = np.where(omtf, np.round(2 * candidate_pt + 1), candidate_pt)
+    candidate_eta = np.where(omtf, np.round(candidate_eta * 240 / 2.61), candidate_eta)
+    omtf_phi = np.round((np.mod(candidate_phi, 2 * np.pi) / (2 * np.pi) - (15 + processor * 60) / 360) * 576)
+    candidate_phi = np.where(omtf, omtf_phi, candidate_phi)
+
+    l1 = {'fUniqueID': np.zeros(n_candidates, dtype=np.int32), 'fBits': np.zeros(n_candidates, dtype=np.int32),
+          'pt': candidate_pt, 'eta': candidate_eta, 'phi': candidate_phi, 'charge': charge[event], 'type': candidate_type,
+          'iProcessor': processor, 'z0': np.zeros(n_candidates), 'd0': np.zeros(n_candidates), 'disc': np.zeros(n_candidates),
+          'hits': rng.integers(0, 2 ** 18, n_candidates), 'hwBeta': np.zeros(n_candidates, dtype=np.int32),
+          'commonStubCount': rng.integers(0, total_stub_count + 1), 'totalStubCount': total_stub_count,
+          'commonStubQuality': rng.integers(0, total_stub_quality + 1), 'totalStubQuality': total_stub_quality}
+
+    chunk = {}
+    for leaf, values in gen.items():
+        values = np.repeat(values, 2).astype(np.int32 if leaf in int_leaves else np.float64)
+        chunk[GEN_PREFIX + leaf] = ak.unflatten(values, gen_counts)
+    for leaf, values in l1.items():
+        values = np.asarray(values).astype(np.int32 if leaf in int_leaves else np.float64)
+        chunk[L1_PREFIX + leaf] = ak.unflatten(values, l1_counts)
+    return chunk
+
+
+# Write a synthetic file, in chunks so that large files do not need much memory; every extend
+# writes one basket per branch, so the chunks are written in pieces of basket_size events
+# (many small baskets, like the real tOmtf files)
+def write_synthetic_file(filename, n_events, candidates_per_event=3.0, displacement=0.0, seed=1, chunk_size=1_000_000, basket_size=BASKET_SIZE):
+    import uproot
+
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    with uproot.recreate(filename) as f:
+        placeholder = make_chunk(1, rng, candidates_per_event, displacement)
+        f[TREE_NAME] = placeholder
+        f[TREE_NAME] = placeholder
+        tree = f.mktree(TREE_NAME, _branch_types())
+        for start in range(0, n_events, chunk_size):
+            chunk = make_chunk(min(chunk_size, n_events - start), rng, candidates_per_event, displacement)
+            for basket_start in range(0, len(next(iter(chunk.values()))), basket_size):
+                tree.extend({branch: values[basket_start:basket_start + basket_size] for branch, values in chunk.items()})
+    return filename
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic ROOT file with the tOmtf layout')
+    parser.add_argument('filename')
+    parser.add_argument('--events', type=float, default=1e5, help='number of events')
+    parser.add_argument('--candidates', type=float, default=3.0, help='mean number of L1 candidates per event')
+    parser.add_argument('--displacement', type=float, default=0.0, help='mean transverse displacement of the vertex [cm], 0 = prompt')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--basket-size', type=int, default=BASKET_SIZE, help='events per basket')
+    args = parser.parse_args()
+
+    write_synthetic_file(args.filename, int(args.events), args.candidates, args.displacement, args.seed, basket_size=args.basket_size)
+    print(f'Written: {args.filename}')
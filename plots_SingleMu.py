@@ -1,23 +1,17 @@
 import numpy as np
-import matplotlib.pyplot as plt
-import pandas as pd
-import uproot as upr
-import awkward as ak
-from matplotlib.colors import LogNorm
-import shutil
 import os
 import sys
-import mplhep as hep
 
 # Add module paths
 sys.path.append(os.path.join(os.getcwd(), "Modules"))
-import importlib
 import system_and_data as sd
 import plotting_functions as pf
 
-# Reload modules (if modified)
-importlib.reload(sd)
-importlib.reload(pf)
+# Reload modules (if modified) when working interactively: RELOAD_MODULES=1
+if os.environ.get('RELOAD_MODULES'):
+    import importlib
+    importlib.reload(sd)
+    importlib.reload(pf)
 
 # Paths to data and output figures
 DATA_PATH = '/scratch/rkomuda/MagisteriumCMS14_2_0_pre2/Analysis/'
@@ -57,9 +51,10 @@ data_prompt_SA = sd.match_gen_muons(data_prompt_SA, data_gen_prompt)
 data_TK = data_prompt[data_prompt['theL1Obj.type'] == 15]
 data_TK = sd.match_gen_muons(data_TK, data_gen_prompt)
 
-# # Refresh figure directories
-sd.refresh_fig_dir(FIG_PATH_SA, refresh=True)
-sd.refresh_fig_dir(FIG_PATH_TK, refresh=True)
+# Wipe the figure directories only when asked (REFRESH_FIGURES=1): they are shared with the
+# campaigns, whose manifests already remove the figures of deleted or moved plots
+sd.refresh_fig_dir(FIG_PATH_SA, refresh=bool(os.environ.get('REFRESH_FIGURES')))
+sd.refresh_fig_dir(FIG_PATH_TK, refresh=bool(os.environ.get('REFRESH_FIGURES')))
 
 
 
@@ -1,41 +1,17 @@
 import numpy as np
-import matplotlib.pyplot as plt
-import pandas as pd
-import uproot as upr
-import awkward as ak
-from matplotlib.colors import LogNorm
-import shutil
 import os
 import sys
-import mplhep as hep
 
 # Add module paths
 sys.path.append(os.path.join(os.getcwd(), "Modules"))
-import importlib
 import system_and_data as sd
 import plotting_functions as pf
 
-# Reload modules (if modified)
-importlib.reload(sd)
-importlib.reload(pf)
-
-def pass_veto(data):
-    pt = data['theL1Obj.pt']
-    stub_count_norm = data['theL1Obj.commonStubCount_norm']
-    
-    if pt <= 2:
-        return False  
-    elif 2 < pt <= 4:
-        return stub_count_norm < 0.06
-    elif 4 < pt <= 6:
-        return stub_count_norm < 0.27
-    elif 6 < pt <= 8:
-        return stub_count_norm < 0.6
-    elif 8 < pt <= 10:
-        return stub_count_norm < 0.74
-    else:
-        return stub_count_norm < 0.95
-
+# Reload modules (if modified) when working interactively: RELOAD_MODULES=1
+if os.environ.get('RELOAD_MODULES'):
+    import importlib
+    importlib.reload(sd)
+    importlib.reload(pf)
 
 # Paths to data and output figures
 DATA_PATH = '/scratch/rkomuda/MagisteriumCMS14_2_0_pre2/Analysis/'
@@ -70,8 +46,9 @@ data_singlemu_SA = sd.match_gen_muons(data_singlemu_SA, data_gen_singlemu)
 # Select Tracker Muons (type 15)
 data_TK = data_displaced[data_displaced['theL1Obj.type'] == 15]
 data_TK = sd.match_gen_muons(data_TK, data_gen_disp)
-# Refresh figure directories
-sd.refresh_fig_dir(FIG_PATH, refresh=True)
+# Wipe the figure directories only when asked (REFRESH_FIGURES=1): they are shared with the
+# campaigns, whose manifests already remove the figures of deleted or moved plots
+sd.refresh_fig_dir(FIG_PATH, refresh=bool(os.environ.get('REFRESH_FIGURES')))
 
 pf.plot_mean_comparison(
     [data_singlemu_SA,data_displaced_SA], ['SingleMu sample','Displaced sample'], 'theColl._pt', 'theL1Obj.commonStubCount',
@@ -95,45 +72,45 @@ pf.plot_efficiency_ptCuts_single_dataset(
     data_displaced_SA, data_gen_disp, 'SAMuon:displaced', 'theColl._pt',
     bins=np.arange(1, 100, 1), xlabel=r'$gen.p_{T} \ [GeV]$',
     ylabel='Efficiency', title=r'Displaced sample BV',
-    fig_path=FIG_PATH, save=True, ptCuts=PT_CUTS
+    fig_path=FIG_PATH, save=True, ptCuts=PT_CUTS, fit='erf'
 )
 pf.plot_efficiency_ptCuts_single_dataset(
     data_singlemu_SA, data_gen_singlemu, 'SAMuon:displaced', 'theColl._pt',
     bins=np.arange(1, 100, 1), xlabel=r'$gen.p_{T} \ [GeV]$',
     ylabel='Efficiency', title=r'SingleMu sample BV',
-    fig_path=FIG_PATH, save=True, ptCuts=PT_CUTS
+    fig_path=FIG_PATH, save=True, ptCuts=PT_CUTS, fit='erf'
 )
 
 
 
-data_singlemu_veto = data_singlemu_SA[data_singlemu_SA.apply(pass_veto, axis=1)]
-data_displaced_veto = data_displaced_SA[data_displaced_SA.apply(pass_veto, axis=1)]
+data_singlemu_veto = sd.apply_veto(data_singlemu_SA)
+data_displaced_veto = sd.apply_veto(data_displaced_SA)
 
 
 pf.plot_efficiency_ptCuts_single_dataset(
     data_singlemu_veto, data_gen_singlemu, 'SAMuon:displaced', 'theColl._pt',
     bins=np.arange(1, 100, 1), xlabel=r'$gen.p_{T} \ [GeV]$',
     ylabel='Efficiency', title=r'SingleMu sample',
-    fig_path=FIG_PATH, save=True, ptCuts=PT_CUTS
+    fig_path=FIG_PATH, save=True, ptCuts=PT_CUTS, fit='erf'
 )
 pf.plot_efficiency_ptCuts_single_dataset(
     data_displaced_veto, data_gen_disp, 'SAMuon:displaced', 'theColl._pt',
     bins=np.arange(1, 100, 1), xlabel=r'$gen.p_{T} \ [GeV]$',
     ylabel='Efficiency', title=r'Displaced sample',
-    fig_path=FIG_PATH, save=True, ptCuts=PT_CUTS
+    fig_path=FIG_PATH, save=True, ptCuts=PT_CUTS, fit='erf'
 )
 
 pf.plot_efficiency_comparison(
     [data_singlemu_SA, data_singlemu_veto],[data_gen_singlemu,data_gen_singlemu], ['SingleMu sample', 'SingleMu sample AV'], 'theColl._pt',
     bins=np.arange(1, 100, 1), xlabel=r'$gen.p_{T} \ [GeV]$',
     ylabel='Efficiency', title=r'SingleMu sample',
-    fig_path=FIG_PATH, save=True, ptCut=0
+    fig_path=FIG_PATH, save=True, ptCut=0, fit='erf'
 )
 pf.plot_efficiency_comparison(
     [data_displaced_SA, data_displaced_veto],[data_gen_disp,data_gen_disp], ['Displaced sample', 'Displaced sample AV'], 'theColl._pt',
     bins=np.arange(1, 100, 1), xlabel=r'$gen.p_{T} \ [GeV]$',
     ylabel='Efficiency', title=r'Displaced sample',
-    fig_path=FIG_PATH, save=True, ptCut=0
+    fig_path=FIG_PATH, save=True, ptCut=0, fit='erf'
 )
 
 
@@ -190,3 +167,23 @@ pf.histogram_1D_comparison(
 )
 
 
+
+# Trigger rate vs threshold: all the SA / TK candidates of every event, without and with the veto
+for data_l1, data_SA, data_veto, data_gen, filename, title in [
+        (data_singlemu, data_singlemu_SA, data_singlemu_veto, data_gen_singlemu, FILENAME_SINGLEMU_DISP, 'SingleMu sample'),
+        (data_displaced, data_displaced_SA, data_displaced_veto, data_gen_disp, FILENAME_DISP_DISP, 'Displaced sample')]:
+    n_events = sd.count_events(filename, DATA_PATH, TREE_NAME)
+    data_l1_SA = data_l1[data_l1['theL1Obj.type'] == 16]
+    data_l1_veto = sd.apply_veto(data_l1_SA)
+    pf.plot_rate_comparison(
+        [data_l1_SA, data_l1_veto, data_l1[data_l1['theL1Obj.type'] == 15]], ['SAMuon', 'SAMuon AV', 'TkMuon'], n_events,
+        bins=np.arange(0, 50, 1), xlabel=r'$L1 \ p_{T} \ threshold \ [GeV]$',
+        ylabel='Fraction of events', title=title,
+        fig_path=FIG_PATH, save=True
+    )
+    pf.plot_rate_vs_efficiency(
+        [data_l1_SA, data_l1_veto], [data_SA, data_veto], [data_gen, data_gen], [title, f'{title} AV'], n_events,
+        bins=np.arange(0, 50, 1), xlabel=r'Efficiency ($gen.p_{T} > 20 \ GeV$)',
+        ylabel='Fraction of events', title=title,
+        fig_path=FIG_PATH, save=True, gen_pt_min=20, ptCuts=PT_CUTS
+    )
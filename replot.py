@@ -0,0 +1,40 @@
+import os
+import sys
+import glob
+import json
+import argparse
+
+# Add module paths
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "Modules"))
+import campaign as cp
+import plotting_functions as pf
+
+# Redraw figures from the .npz files saved next to them (save_data=True), e.g.:
+#   python replot.py /scratch/.../fig_png_veto/ --set title="Displaced sample"
+parser = argparse.ArgumentParser(description='Redraw figures from their stored plot data')
+parser.add_argument('paths', nargs='+', help='.npz files or figure directories')
+parser.add_argument('--profile', choices=sorted(pf.render_profiles), default='publication',
+                    help='render profile: preview (fast, low resolution) or publication')
+parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                    help='override a drawing option (value read as JSON if possible, e.g. ptCuts=[0,5])')
+args = parser.parse_args()
+
+pf.set_render_profile(args.profile)
+
+overrides = {}
+for setting in args.set:
+    key, value = setting.split('=', 1)
+    try:
+        overrides[key] = json.loads(value)
+    except json.JSONDecodeError:
+        overrides[key] = value
+
+data_names = []
+for path in args.paths:
+    data_names += sorted(glob.glob(os.path.join(path, '*.npz'))) if os.path.isdir(path) else [path]
+
+# Figures of campaign plots are added to their manifest entries (other profiles than publication get a suffix)
+for data_name in data_names:
+    fig_name = pf.replot_from_data(data_name, **overrides)
+    cp.record_replot(data_name, fig_name)
+    print(fig_name)
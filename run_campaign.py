@@ -0,0 +1,87 @@
+import os
+import sys
+import argparse
+
+# Add module paths
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "Modules"))
+import campaign as cp
+import plotting_functions as pf
+import instrumentation as ins
+import system_and_data as sd
+
+# Run one or more plot campaigns, e.g.:
+#   python run_campaign.py campaigns/SingleMu.yaml campaigns/veto.yaml --tags efficiency --jobs 8
+#   python run_campaign.py campaigns/veto.yaml --fraction 0.01 --profile preview   (quick preview)
+parser = argparse.ArgumentParser(description='Run plot campaigns, loading every sample once')
+parser.add_argument('campaigns', nargs='+', help='campaign files (.yaml or .toml)')
+parser.add_argument('--tags', nargs='+', help='run only the plots with any of these tags')
+parser.add_argument('--plots', nargs='+', help='run only the plots with these names')
+parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='number of parallel loaders / plot workers')
+parser.add_argument('--rebuild', action='store_true', help='remake the chosen plots even if they are up to date')
+parser.add_argument('--replot', action='store_true', help='redraw the chosen plots from their stored data, without loading samples')
+parser.add_argument('--profile', choices=sorted(pf.render_profiles), default='publication',
+                    help='render profile: preview (fast, low resolution) or publication')
+parser.add_argument('--format', choices=['png', 'svg', 'pdf'], help='figure file format (default: from the profile)')
+parser.add_argument('--efficiency-errors', choices=pf.unc.efficiency_methods, default='clopper_pearson',
+                    help='efficiency error bars: exact interval, Poisson bootstrap or normal approximation')
+parser.add_argument('--mean-errors', choices=['sem', 'bootstrap'], default='sem', help='error bars of the binned means')
+parser.add_argument('--replicas', type=int, default=200, help='number of bootstrap replicas')
+parser.add_argument('--chunk-size', type=int, default=500_000, help='entries read per chunk (0: the whole tree at once)')
+parser.add_argument('--prefetch', type=int, default=2, help='number of chunks read ahead in the background (0: no prefetch)')
+parser.add_argument('--prefetch-max-mb', type=int, default=2048, help='memory limit of the chunks read ahead')
+parser.add_argument('--fraction', type=float, default=1.0, help='read only this fraction of the events (e.g. 0.01 for a quick preview)')
+parser.add_argument('--sampling', choices=sd.sampling_modes, default='stride',
+                    help='which events --fraction keeps: evenly spaced blocks of entries (stride) or hashed entry numbers (hash)')
+parser.add_argument('--export-dataset', metavar='DIR',
+                    help='write the gen and matched tables of the campaigns as a partitioned Parquet dataset to DIR and exit')
+parser.add_argument('--report', help='write the per-stage timing and memory records to this file (.json or .csv)')
+parser.add_argument('--list-plots', action='store_true', help='list the chosen plots and exit')
+parser.add_argument('--dry-run', action='store_true', help='show which plots would be made and which tables loaded, and exit')
+args = parser.parse_args()
+
+if args.format:
+    pf.set_render_profile(args.profile, format=args.format)
+else:
+    pf.set_render_profile(args.profile)
+
+pf.set_uncertainty(efficiency=args.efficiency_errors, mean=args.mean_errors, n_replicas=args.replicas)
+sd.set_reading(chunk_size=args.chunk_size or None, prefetch_depth=args.prefetch, prefetch_max_mb=args.prefetch_max_mb,
+               fraction=args.fraction, sampling=args.sampling)
+
+campaigns = [cp.read_campaign(filename) for filename in args.campaigns]
+
+if args.list_plots:
+    for campaign in campaigns:
+        for plot in cp.select_plots(campaign, args.tags, args.plots):
+            print(f"{campaign['name']}: {plot['name']}  [{', '.join(plot['tags'])}]")
+    sys.exit(0)
+
+if args.dry_run:
+    campaigns_and_plots, _, _ = cp.plan_campaigns(campaigns, args.tags, args.plots, args.rebuild)
+    for campaign, plots in campaigns_and_plots:
+        for plot in plots:
+            print(f"  to make: {campaign['name']}/{plot['name']}")
+    loads, matches = cp.build_graph(campaigns_and_plots)
+    for path, filename, tree, branch in sorted(loads):
+        print(f'  to load: {filename} {tree} {branch}')
+    sys.exit(0)
+
+if args.replot:
+    cp.replot_campaigns(campaigns, tags=args.tags, names=args.plots)
+    sys.exit(0)
+
+if args.export_dataset:
+    exported = cp.export_dataset(campaigns, args.export_dataset, jobs=args.jobs)
+    print(f'Tables exported: {len(exported)}')
+    sys.exit(0)
+
+cp.run_campaigns(campaigns, tags=args.tags, names=args.plots, jobs=args.jobs, rebuild=args.rebuild)
+
+ins.print_summary()
+if args.report:
+    print(f'Report written: {ins.write_report(args.report)}')
+
+violations = ins.check_budgets(cp.stage_budgets(campaigns))
+for name, wall_s, budget in violations:
+    print(f'OVER BUDGET {name}: {wall_s:.2f} s > {budget:.2f} s')
+sys.exit(1 if violations else 0)
@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+# Add module paths, like the scripts do
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT_DIR, 'Modules'))
+sys.path.append(os.path.join(ROOT_DIR, 'benchmarks'))
+
+
+# Small synthetic tOmtf file, written once per test session
+@pytest.fixture(scope='session')
+def synthetic_file(tmp_path_factory):
+    import synthetic_tomtf
+
+    filename = tmp_path_factory.mktemp('data') / 'synthetic.root'
+    synthetic_tomtf.write_synthetic_file(str(filename), 2000, basket_size=500)
+    return filename
@@ -0,0 +1,70 @@
+import os
+import json
+import threading
+import urllib.error
+import urllib.request
+from http.server import HTTPServer
+
+import pytest
+
+import analysis_service as service
+import plotting_functions as pf
+
+
+@pytest.fixture(scope='module')
+def server(tmp_path_factory, synthetic_file):
+    spec = {
+        'name': 'service',
+        'data_path': str(synthetic_file.parent) + '/',
+        'samples': {'syn': {'file': synthetic_file.name}},
+        'selections': {'gen': {'sample': 'syn'}, 'SA': {'sample': 'syn', 'object': 'SA'}},
+        'figures': {'main': str(tmp_path_factory.mktemp('figures')) + '/'},
+        'plots': [],
+    }
+    filename = tmp_path_factory.mktemp('campaign') / 'service.json'
+    filename.write_text(json.dumps(spec))
+    service.start_service([str(filename)])
+    httpd = HTTPServer(('127.0.0.1', 0), service.AnalysisRequestHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield httpd.server_address
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _post(address, kind, request):
+    data = json.dumps(request).encode()
+    try:
+        with urllib.request.urlopen(f'http://{address[0]}:{address[1]}/{kind}', data=data) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as error:
+        return error.code, json.loads(error.read())
+
+
+def test_select_eta_region_rejects_unknown_region():
+    import pandas as pd
+
+    data = pd.DataFrame({'theColl._eta': [0.5, 1.0, 2.0]})
+    assert [len(pf.select_eta_region(data, region)) for region in pf.eta_regions] == [1, 1, 1]
+    with pytest.raises(ValueError, match='FOO'):
+        pf.select_eta_region(data, 'FOO')
+
+
+def test_unknown_eta_region_is_a_bad_request(server):
+    request = {'selection': 'gen', 'column': 'theColl._pt', 'bins': {'arange': [0, 100, 10]}}
+    assert _post(server, 'histogram', dict(request, eta_region='EMTF'))[0] == 200
+    status, answer = _post(server, 'histogram', dict(request, eta_region='FOO'))
+    assert status == 400 and 'FOO' in answer['error']
+
+
+def test_plot_is_made_again_when_its_files_are_gone(server, tmp_path):
+    request = {'function': 'histogram_1D_comparison', 'fig_path': str(tmp_path) + '/',
+               'args': {'datasets': ['gen'], 'dataset_labels': ['gen'], 'column': 'theColl._pt',
+                        'bins': {'arange': [0, 100, 10]}, 'xlabel': 'pt', 'ylabel': 'n', 'title': 'service plot'}}
+    status, answer = _post(server, 'plot', request)
+    assert status == 200 and answer['outputs']
+    for output in answer['outputs']:
+        os.remove(output)
+
+    status, again = _post(server, 'plot', request)
+    assert status == 200 and again['outputs'] == answer['outputs']
+    assert all(os.path.exists(output) for output in again['outputs'])
@@ -0,0 +1,61 @@
+import os
+import json
+
+import campaign as cp
+
+
+def _write_campaign(tmp_path, synthetic_file, fig_path):
+    spec = {
+        'name': 'moved',
+        'data_path': str(synthetic_file.parent) + '/',
+        'samples': {'syn': {'file': synthetic_file.name}},
+        'selections': {'gen': {'sample': 'syn'}},
+        'figures': {'old': str(tmp_path / 'old') + '/', 'new': str(tmp_path / 'new') + '/'},
+        'save_data': True,
+        'plots': [{'name': 'gen_pt', 'function': 'histogram_1D_comparison', 'fig_path': fig_path,
+                   'args': {'datasets': ['gen'], 'dataset_labels': ['gen'], 'column': 'theColl._pt',
+                            'bins': {'arange': [0, 100, 10]}, 'xlabel': 'pt', 'ylabel': 'n', 'title': 'gen pt'}}],
+    }
+    filename = tmp_path / 'moved.json'
+    filename.write_text(json.dumps(spec))
+    return cp.read_campaign(str(filename))
+
+
+def test_moved_plot_is_removed_from_old_directory(tmp_path, synthetic_file):
+    cp.run_campaigns([_write_campaign(tmp_path, synthetic_file, 'old')], jobs=1)
+    old_outputs = cp.read_manifest(str(tmp_path / 'old'))['moved/gen_pt']['outputs']
+    assert old_outputs and all(os.path.exists(output) for output in old_outputs)
+
+    cp.run_campaigns([_write_campaign(tmp_path, synthetic_file, 'new')], jobs=1)
+    assert cp.read_manifest(str(tmp_path / 'old')) == {}
+    assert not any(os.path.exists(output) for output in old_outputs)
+    assert os.path.basename(old_outputs[0]) not in (tmp_path / 'old' / cp.CONTACT_SHEET_NAME).read_text()
+    new_outputs = cp.read_manifest(str(tmp_path / 'new'))['moved/gen_pt']['outputs']
+    assert new_outputs and all(os.path.exists(output) for output in new_outputs)
+
+
+def test_preview_replot_keeps_tracked_figure(tmp_path, synthetic_file):
+    import plotting_functions as pf
+
+    campaign = _write_campaign(tmp_path, synthetic_file, 'old')
+    cp.run_campaigns([campaign], jobs=1)
+    outputs = cp.read_manifest(str(tmp_path / 'old'))['moved/gen_pt']['outputs']
+    fig_name = [output for output in outputs if output.endswith('.png')][0]
+    published = (tmp_path / fig_name).read_bytes()
+
+    try:
+        pf.set_render_profile('preview')
+        preview, = cp.replot_campaigns([campaign])
+        pf.set_render_profile('publication', format='svg')
+        svg, = cp.replot_campaigns([campaign])
+    finally:
+        pf.set_render_profile('publication')
+    assert preview.endswith('_preview.png') and svg.endswith('.svg')
+    assert (tmp_path / fig_name).read_bytes() == published
+    recorded = cp.read_manifest(str(tmp_path / 'old'))['moved/gen_pt']['outputs']
+    assert preview in recorded and svg in recorded
+    assert cp.run_campaigns([campaign], jobs=1) == []
+
+    # moving the plot removes the redrawn figures too
+    cp.run_campaigns([_write_campaign(tmp_path, synthetic_file, 'new')], jobs=1)
+    assert not os.path.exists(preview) and not os.path.exists(svg)